@@ -1,10 +1,60 @@
-from typing import Union
+import asyncio
+import json
+from contextlib import aclosing, asynccontextmanager
+from datetime import datetime
+from typing import List, Union
 from app import ai_assistant as assist
+from app import conversation_batch
+from app import http_cache
+from app import metrics
+from app import model_router
+from app import startup
+from app import tenants
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
 
-app = FastAPI()
-chatbot = assist.AIAssistant()
+# importing this module does no I/O, the lifespan hook connects and warms the caches before traffic is accepted
+services = startup.Services()
+
+
+# the first attempt holds back traffic, if it fails the app starts serving /healthz and /readyz
+# while warm-up is retried in the background
+async def retry_warm_up():
+    while not services.ready and not services.gave_up():
+        await asyncio.sleep(services.retry_delay())
+        await asyncio.to_thread(services.warm_up)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(services.warm_up)
+    retries = None if services.ready else asyncio.create_task(retry_warm_up())
+    yield
+    if retries is not None:
+        retries.cancel()
+    services.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+# the location can come from a header, so shared caches have to keep one copy per location for the same URL
+menu_responses = http_cache.CachedJSONResponses(vary=("X-Location-Id",))
+
+
+def require_ready():
+    if not services.ready:
+        raise HTTPException(status_code=503, detail="Service is warming up.")
+    services.sync_shared_index()
+
+
+# the location comes from ?location_id= or the X-Location-Id header, requests without one go to the default location
+def current_tenant(location_id: Union[str, None] = None,
+                   x_location_id: Union[str, None] = Header(default=None)) -> tenants.Tenant:
+    try:
+        return services.tenants.get(location_id or x_location_id)
+    except tenants.UnknownLocation:
+        raise HTTPException(status_code=404, detail=f"No location named {location_id or x_location_id}.")
 
 
 @app.get("/")
@@ -16,7 +66,150 @@ def read_root():
 def read_item(item_id: int, q: Union[str, None] = None):
     return {"item_id": item_id, "q": q}
 
-@app.get("/get_response/{user_prompt}")
-async def get_response(user_prompt: str):
-    ai_response = chatbot.bot_entry_point(user_prompt)
+
+# only fails once warm-up gave up, so a process that can't start gets restarted
+@app.get("/healthz")
+def healthz():
+    if services.gave_up():
+        return JSONResponse({"status": "failed", "error": services.error}, status_code=503)
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    return JSONResponse(services.readiness(), status_code=200 if services.ready else 503)
+
+
+# a plain def runs in the threadpool, the turn's model and database calls would otherwise block the event loop
+# that serves the kitchen feed streams
+@app.get("/get_response/{user_prompt}", dependencies=[Depends(require_ready)])
+def get_response(user_prompt: str, tenant: tenants.Tenant = Depends(current_tenant)):
+    ai_response = tenant.chatbot.bot_entry_point(user_prompt)
     return ai_response
+
+
+class BatchRequest(BaseModel):
+    # messages the client buffered for the live conversation
+    messages: List[str] = []
+    # recorded conversations to replay, each on a fresh assistant
+    transcripts: List[List[Union[str, List[str]]]] = []
+
+
+@app.post("/get_responses", dependencies=[Depends(require_ready)])
+def get_responses(batch: BatchRequest, tenant: tenants.Tenant = Depends(current_tenant)):
+    responses = tenant.chatbot.bot_batch_entry_point(batch.messages) if batch.messages else []
+    transcript_responses = conversation_batch.replay_transcripts(
+        batch.transcripts,
+        lambda: assist.AIAssistant(tenant.db_helper, router=model_router.replay_router(),
+                                   few_shot_store=services.few_shot_store, dry_run=True)
+    )
+    return {"responses": responses, "transcripts": transcript_responses}
+
+
+# /menu/search has to be registered before /menu/{section} or "search" is taken as a section name
+@app.get("/menu/search", dependencies=[Depends(require_ready)])
+def search_menu(request: Request, q: str = "", tenant: tenants.Tenant = Depends(current_tenant)):
+    menu = tenant.db_helper.get_menu_snapshot()
+    # the search ignores case and spacing, so queries that only differ in those share one cached body
+    query = " ".join(q.lower().split())
+    return menu_responses.respond(request, f"{tenant.location_id}/menu/search?q={query}", menu.version,
+                                  lambda: {"version": menu.version, "query": query,
+                                           "items": menu.query_engine.search(query)})
+
+
+@app.get("/menu", dependencies=[Depends(require_ready)])
+def get_menu(request: Request, tenant: tenants.Tenant = Depends(current_tenant)):
+    menu = tenant.db_helper.get_menu_snapshot()
+    return menu_responses.respond(request, f"{tenant.location_id}/menu", menu.version, menu.to_dict)
+
+
+@app.get("/menu/{section}", dependencies=[Depends(require_ready)])
+def get_menu_section(request: Request, section: str, tenant: tenants.Tenant = Depends(current_tenant)):
+    menu = tenant.db_helper.get_menu_snapshot()
+    items = menu.section(section)
+    if items is None:
+        raise HTTPException(status_code=404, detail=f"No menu section named {section}.")
+    return menu_responses.respond(request, f"{tenant.location_id}/menu/{section.lower()}", menu.version,
+                                  lambda: {"version": menu.version, "section": section.lower(), "items": items})
+
+
+@app.get("/reports/top_sellers", dependencies=[Depends(require_ready)])
+def top_sellers(limit: int = 10, tenant: tenants.Tenant = Depends(current_tenant)):
+    return tenant.db_helper.sales_reports.top_sellers(limit)
+
+
+@app.get("/reports/revenue_per_hour", dependencies=[Depends(require_ready)])
+def revenue_per_hour(start: Union[datetime, None] = None, end: Union[datetime, None] = None,
+                     tenant: tenants.Tenant = Depends(current_tenant)):
+    return tenant.db_helper.sales_reports.revenue_per_hour(start, end)
+
+
+@app.get("/reports/average_ticket", dependencies=[Depends(require_ready)])
+def average_ticket(tenant: tenants.Tenant = Depends(current_tenant)):
+    return tenant.db_helper.sales_reports.average_ticket()
+
+
+@app.post("/reports/rebuild", dependencies=[Depends(require_ready)])
+def rebuild_reports(tenant: tenants.Tenant = Depends(current_tenant)):
+    tenant.db_helper.sales_reports.ensure_indexes()
+    tenant.db_helper.sales_reports.rebuild_rollups()
+    return {"rebuilt": True}
+
+
+# Server-sent events. Browsers resend the last event id in Last-Event-ID when they reconnect,
+# other clients can pass it as ?resume=
+@app.get("/kitchen/feed", dependencies=[Depends(require_ready)])
+async def kitchen_feed(resume: Union[str, None] = None, last_event_id: Union[str, None] = Header(default=None),
+                       tenant: tenants.Tenant = Depends(current_tenant)):
+    async def event_stream():
+        async with aclosing(services.kitchen_feed.subscribe(tenant.location_id, last_event_id or resume)) as events:
+            async for event in events:
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/kitchen/ws")
+async def kitchen_ws(websocket: WebSocket, resume: Union[str, None] = None, location_id: Union[str, None] = None):
+    if not services.ready:
+        await websocket.close(code=1013)  # try again later
+        return
+    try:
+        tenant = await asyncio.to_thread(services.tenants.get, location_id)
+    except tenants.UnknownLocation:
+        await websocket.close(code=1008)  # policy violation, no such location
+        return
+    await websocket.accept()
+    try:
+        async with aclosing(services.kitchen_feed.subscribe(tenant.location_id, resume)) as events:
+            async for event in events:
+                await websocket.send_json(event if event is not None else {"type": "heartbeat"})
+    except WebSocketDisconnect:
+        pass
+
+
+# rereads a location's menu and FAQ, for the default location every worker picks the new version up from
+# the shared index, other locations are only refreshed in the worker that got the request
+@app.post("/admin/refresh", dependencies=[Depends(require_ready)])
+def refresh_indexes(tenant: tenants.Tenant = Depends(current_tenant)):
+    shared_index_version = None
+    if tenant is services.tenants.default_tenant:
+        shared_index_version = services.rebuild_shared_index()
+    else:
+        tenant.db_helper.refresh_caches()
+    return {"location_id": tenant.location_id, "shared_index_version": shared_index_version,
+            "menu_version": tenant.db_helper.get_menu_snapshot().version}
+
+
+@app.get("/metrics/models")
+def model_metrics():
+    return model_router.default_router().report()
+
+
+@app.get("/metrics/turns")
+def turn_metrics():
+    return metrics.turn_metrics.snapshot()
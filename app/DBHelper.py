@@ -1,23 +1,46 @@
 import os
-from typing import List
+from typing import Callable, List
 
-from dotenv import load_dotenv, find_dotenv
-from pymongo import MongoClient, ReturnDocument
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument
 from bson.json_util import dumps
 
+from app import customer_profiles
+from app import menu_snapshot
+from app import sales_reports
+from app import settings
+from app import tenants
+
 
 class DBHandler:
+    # collections shared by every location, each document carries the location_id it belongs to
+    TENANT_COLLECTIONS = {"menu", "FAQ", "orders"}
 
-    def __init__(self):
-        load_dotenv(find_dotenv())
+    def __init__(self, location_id: str | None = None, client: MongoClient | None = None):
+        """
+        :param location_id: location whose menu, FAQ and orders this handler reads and writes.
+                            The default location (DEFAULT_LOCATION_ID) when not given.
+        :param client: connection to reuse, handlers for different locations share one.
+        """
+        settings.load_environment()
         self.MONGO_USERNAME = os.getenv("MONGODB_USERNAME")
         self.MONGO_PASSWORD = os.getenv("MONGODB_PASSWORD")
         self.MONGO_CONNECTION_STRING = os.getenv("MONGODB_CONNECTION_STRING")
         self.MONGO_CONNECTION_STRING = self.MONGO_CONNECTION_STRING.replace("<username>", self.MONGO_USERNAME)
         self.MONGO_CONNECTION_STRING = self.MONGO_CONNECTION_STRING.replace("<password>", self.MONGO_PASSWORD)
-        self.MONGO_DATABASE = "Online-Assistant-DB"
-        self.__connect()
+        self.MONGO_DATABASE = os.getenv("MONGODB_DATABASE", "Online-Assistant-DB")
+        self.location_id = location_id or tenants.default_location_id()
+        if client is None:
+            self.__connect()
+        else:
+            self.client = client
         self.db = self.client[self.MONGO_DATABASE]
+        self.sales_reports = sales_reports.SalesReports(self.db, self.location_id)
+        self.customer_profiles = customer_profiles.CustomerProfiles(self.db.orders)
+        self.__menu_cache: str | None = None
+        self.__menu_snapshot: menu_snapshot.MenuSnapshot | None = None
+        self.__field_names_cache = {}
+        # called with ("inserted" | "updated", order document) after each successful order write
+        self.order_listeners: List[Callable[[str, dict], None]] = []
 
     def __enter__(self):
         self.__connect()
@@ -41,6 +64,64 @@ class DBHandler:
     def __disconnect(self):
         self.client.close()
 
+    def for_location(self, location_id: str) -> "DBHandler":
+        """
+        Returns a handler for another location that shares this one's connection, customer profiles and
+        order listeners, with its own menu and FAQ caches.
+        """
+        handler = DBHandler(location_id, client=self.client)
+        handler.customer_profiles = self.customer_profiles
+        handler.order_listeners = self.order_listeners
+        return handler
+
+    def ensure_indexes(self) -> None:
+        """
+        Creates the indexes for reading one location's data out of the shared collections.
+        Every index starts with location_id so a location's lookups never touch another location's documents.
+        """
+        self.db.orders.create_index([("location_id", ASCENDING), ("_id", DESCENDING)])
+        self.db.get_collection("menu").create_index([("location_id", ASCENDING)])
+        self.db.get_collection("FAQ").create_index([("location_id", ASCENDING)])
+        self.customer_profiles.ensure_indexes()
+        self.sales_reports.ensure_indexes()
+
+    # restricts a query on a shared collection to this handler's location
+    def __scoped(self, collection_name: str, query: dict) -> dict:
+        if collection_name not in self.TENANT_COLLECTIONS:
+            return query
+        return {"$and": [query, tenants.location_filter(self.location_id)]} if query else \
+            tenants.location_filter(self.location_id)
+
+    def ping(self) -> bool:
+        """
+        Round-trips to the MongoDB server, MongoClient itself connects lazily.
+        :return: True if the server answered.
+        """
+        try:
+            self.client.admin.command("ping")
+            return True
+        except Exception as error:
+            print(f"MongoDB ping failed: \n{error}")
+            return False
+
+    def refresh_caches(self) -> None:
+        """
+        Drops the cached menu and FAQ field names so the next read goes to the database.
+        """
+        self.__menu_cache = None
+        self.__menu_snapshot = None
+        self.__field_names_cache = {}
+
+    def seed_caches(self, menu_json: str, field_names: dict) -> None:
+        """
+        Fills the menu and field name caches from data read elsewhere (the shared index) instead of the database.
+        :param menu_json: menu documents in the format get_menu returns.
+        :param field_names: {collection name: field names}.
+        """
+        self.__menu_cache = menu_json
+        self.__menu_snapshot = None
+        self.__field_names_cache = {collection: list(names) for collection, names in field_names.items()}
+
     # def __find_document(self, query: str, collection_name: str) -> None | object:
     #     """
     #     Private method to check collection for documents and return cursor object if documents are found
@@ -59,7 +140,8 @@ class DBHandler:
         :param doc_field: Dictionary containing the search criteria.
         :return: None if no documents are found, otherwise a cursor object.
         """
-        output = self.db.get_collection(collection_name).find({}, {"_id": 0, f"{doc_field}": 1})
+        output = self.db.get_collection(collection_name).find(self.__scoped(collection_name, {}),
+                                                              {"_id": 0, f"{doc_field}": 1})
         if output is None:
             return None
         output = dumps(output)
@@ -72,13 +154,17 @@ class DBHandler:
         :param collection_name: name of the collection to search.
         :return: List of all field names in the collection.
         """
-        all_documents = self.db.get_collection(collection_name).find()
+        if collection_name in self.__field_names_cache:
+            return list(self.__field_names_cache[collection_name])
+        all_documents = self.db.get_collection(collection_name).find(self.__scoped(collection_name, {}))
         field_names = set()
         for document in all_documents:
             field_names.update(document.keys())
+        field_names.discard("location_id")
         field_names = list(field_names)
         field_names.remove("_id")
-        return field_names
+        self.__field_names_cache[collection_name] = field_names
+        return list(field_names)
 
     def read_example_order(self) -> str | None:
         """
@@ -94,14 +180,21 @@ class DBHandler:
 
     def insert_order(self, query: dict):
         """
-        Inserts a single document into the orders collection.
+        Inserts a single document into the orders collection and folds it into the sales rollups
+        and the customer profiles. The order is stamped with this handler's location and its customer lookup keys.
         :param query: dictionary of content to add to the database.
         """
+        query["location_id"] = self.location_id
+        query.update(self.customer_profiles.lookup_keys(query))
         try:
-            self.db.orders.insert_one(query)
+            result = self.db.orders.insert_one(query)
+            self.sales_reports.record_order(query, result.inserted_id.generation_time)
+            self.customer_profiles.remember(query)
         except Exception as error:
             print(error)
             print("Failed to add order to database.")
+            return
+        self.__notify_order_listeners("inserted", query)
 
     def update_order(self, query: dict, update_data: dict):
         """
@@ -110,23 +203,56 @@ class DBHandler:
         :param update_data: dictionary of content to update the order with.
         """
         try:
-            self.db.orders.update_one(query, update_data)
+            order = self.db.orders.find_one_and_update(self.__scoped("orders", query), update_data,
+                                                       return_document=ReturnDocument.AFTER)
         except Exception as error:
             print(f"Failed to update order in database: \nf{error}")
+            return
+        if order is not None:
+            self.__notify_order_listeners("updated", order)
+
+    # a failing listener must not look like a failed order write
+    def __notify_order_listeners(self, event_type: str, order: dict) -> None:
+        for listener in self.order_listeners:
+            try:
+                listener(event_type, order)
+            except Exception as error:
+                print(f"Order listener failed: \n{error}")
+
+    def read_recent_orders(self, limit: int = 50, location_id: str | None = None) -> List[dict]:
+        """
+        Returns the most recently placed orders of a location, newest first.
+        :param limit: most orders to return.
+        :param location_id: location to read, this handler's location when not given.
+        """
+        query = {"$and": [{"name": {"$ne": "EXAMPLE_ORDER"}},
+                          tenants.location_filter(location_id or self.location_id)]}
+        return list(self.db.orders.find(query).sort("_id", -1).limit(limit))
 
     def get_menu(self):
+        if self.__menu_cache is not None:
+            return self.__menu_cache
         query = {
             "$and": [
                 {"beer_menu": {"$exists": True}},
                 {"food_menu": {"$exists": True}}
             ]
         }
-        result = self.db.get_collection("menu").find(query, {"_id": 0})
+        result = self.db.get_collection("menu").find(self.__scoped("menu", query), {"_id": 0})
         if result is None:
             return None
         output = dumps(result)
+        self.__menu_cache = output
         return output
 
+    def get_menu_snapshot(self) -> menu_snapshot.MenuSnapshot:
+        """
+        Returns the parsed menu, only reading and parsing the menu document the first time.
+        """
+        if self.__menu_snapshot is None:
+            self.__menu_snapshot = menu_snapshot.MenuSnapshot.from_json(self.get_menu())
+        return self.__menu_snapshot
+
     # def update_orders(self, query: dict, update_data: dict, multiple_orders: bool) -> None | object:
     #     """
     #     Updates one or many orders.
@@ -1,14 +1,22 @@
+import difflib
 import json
 import os
+import time
+import uuid
 from typing import List
 
 import openai
-from dotenv import load_dotenv, find_dotenv
 
 from app import DBHelper
+from app import customer_profiles
+from app import deadline
+from app import event_log
+from app import few_shot
+from app import local_rules
+from app import metrics
+from app import model_router
+from app import settings
 
-load_dotenv(find_dotenv())
-openai.api_key = os.getenv("OPENAI_API_KEY")
 '''
 # leaving this in to use later
 FUNCTIONS = [
@@ -35,15 +43,30 @@ FUNCTIONS = [
 
 
 class AIAssistant:
-    __MODEL = 'gpt-3.5-turbo-0613'
     __SUMMARY_LENGTH = 150
     __CHAT_HISTORY_LENGTH = 16  # making this too high results in slower response and more token usage
-
-    def __init__(self):
+    __FAQ_UNAVAILABLE_RESPONSE = ("I can't look that up right now. Please call the brewery at 555-987-6543 or reach "
+                                  "out on social media/email to get an answer to your question.")
+    __NICE_RESPONSE_FALLBACK = "Sorry, I didn't catch that. Could you say that another way?"
+
+    def __init__(self, db_helper: DBHelper.DBHandler | None = None,
+                 turn_log: event_log.TurnEventLog | None = None, session_id: str | None = None,
+                 router: model_router.ModelRouter | None = None, few_shot_store: few_shot.FewShotStore | None = None,
+                 dry_run: bool = False):
+        """
+        :param dry_run: confirmed orders are kept in submitted_orders instead of being written to the database,
+                        for replaying recorded conversations. Its turns are left out of the live metrics and its
+                        model calls go through the replay router unless a router is given.
+        """
+        settings.load_environment()
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        if router is None:
+            router = model_router.replay_router() if dry_run else model_router.default_router()
+        self.__router = router
+        self.__few_shot = few_shot_store if few_shot_store is not None else few_shot.default_store()
         self.__chat_holder: List[dict] = []
-        self.__db_helper = DBHelper.DBHandler()
+        self.__db_helper = db_helper if db_helper is not None else DBHelper.DBHandler()
         self.__convo_intent = ""
-        self.__general_question_classifications = self.__db_helper.get_all_field_names("FAQ")
         self.__order_holder = {
             "order_items": None,
             "user_name": None,
@@ -54,6 +77,13 @@ class AIAssistant:
         }
         self.__order_complete_flag = False
         self.__order_verified_flag = False
+        # fields filled in from a returning customer's last order, their phone and email are shown masked
+        self.__prefilled_fields = set()
+        self.__turn_log = turn_log
+        self.__session_id = session_id or uuid.uuid4().hex
+        self.__event_seq = 0
+        self.dry_run = dry_run
+        self.submitted_orders: List[dict] = []
 
     ##################################################
     ################ HELPER FUNCTIONS ################
@@ -65,8 +95,65 @@ class AIAssistant:
             print(chat)
         print("------------------------------------")
 
+    # events are only queued here, the log writes them on its own thread
+    def __log_event(self, event_type: str, data: dict) -> None:
+        if self.__turn_log is None:
+            return
+        self.__turn_log.append(self.__session_id, self.__event_seq, event_type, data, self.__db_helper.location_id)
+        self.__event_seq += 1
+
+    @property
+    def session_id(self) -> str:
+        return self.__session_id
+
+    def restore_from_log(self) -> None:
+        """
+        Rebuilds the conversation state of this session by replaying its logged events.
+        Used after a restart so in-flight orders are not lost.
+        """
+        if self.__turn_log is None:
+            return
+        for event in self.__turn_log.read_session(self.__session_id):
+            data = event["data"]
+            match event["type"]:
+                case "checkpoint":
+                    self.__chat_holder = list(data["chat"])
+                    self.__order_holder = dict(data["order"])
+                    self.__order_complete_flag = data["complete"]
+                    self.__prefilled_fields = set(data["prefilled"])
+                    self.__convo_intent = data["intent"]
+                case "chat":
+                    self.__chat_holder.append({'role': data["role"], 'content': data["content"]})
+                case "chat_summary":
+                    del self.__chat_holder[:3]
+                    self.__chat_holder.insert(0, {'role': 'system',
+                                                  'content': f'Previous chat summary: {data["summary"]}'})
+                case "order_update":
+                    self.__order_holder[data["key"]] = data["value"]
+                    if data.get("prefilled"):
+                        self.__prefilled_fields.add(data["key"])
+                    else:
+                        self.__prefilled_fields.discard(data["key"])
+                    self.__order_flag_raise()
+                case "order_flag":
+                    self.__order_complete_flag = data["complete"]
+                case "order_reset":
+                    self.__order_holder = {key: None for key in self.__order_holder if key != "order_total"}
+                    self.__prefilled_fields = set()
+                    self.__order_flag_raise()
+                    self.__convo_intent = ""
+                case "intent":
+                    self.__convo_intent = data["intent"]
+            self.__event_seq = event["seq"] + 1
+
     def __submit_order(self, order_to_submit: dict) -> str:
-        self.__db_helper.insert_order(order_to_submit)
+        if self.dry_run:
+            self.submitted_orders.append(dict(order_to_submit))
+        else:
+            self.__db_helper.insert_order(order_to_submit)
+            metrics.turn_metrics.increment("orders_submitted")
+            if self.__prefilled_fields:
+                metrics.turn_metrics.increment("orders_prefilled_from_profile")
         self.__reset_order()
         return "Your order has been submitted."
 
@@ -81,6 +168,18 @@ class AIAssistant:
         }
         self.__order_flag_raise()
         self.__convo_intent = ""
+        self.__prefilled_fields = set()
+        self.__log_event("order_reset", {})
+        self.__start_session()
+
+    # sessions are cut after every order and every summary and start with a checkpoint of the state,
+    # so restoring after a restart replays at most one order's worth of events however long the process ran
+    def __start_session(self) -> None:
+        self.__session_id = uuid.uuid4().hex
+        self.__event_seq = 0
+        self.__log_event("checkpoint", {"chat": list(self.__chat_holder), "order": dict(self.__order_holder),
+                                        "complete": self.__order_complete_flag,
+                                        "prefilled": sorted(self.__prefilled_fields), "intent": self.__convo_intent})
 
     # raises the order complete flag if all order fields are filled
     def __order_flag_raise(self):
@@ -92,18 +191,42 @@ class AIAssistant:
     # performs updates to the order, adds messages to chat history, and raises the order complete flag
     def __order_update(self, key, value):
         self.__order_holder[key] = value
+        self.__prefilled_fields.discard(key)
+        self.__log_event("order_update", {"key": key, "value": value})
         self.__add_to_chat_history('assistant',
                                    f"Order updated with the following items: {key} = {value}")
+        if key in ("user_phone", "user_email"):
+            self.__prefill_from_profile(key, value)
         self.__order_flag_raise()
 
-    def __order_items_total_calculator(self, order_items: dict) -> dict:
-        beer_menu = {}
-        food_menu = {}
-        db_menu = json.loads(self.__db_helper.get_menu())
+    # returning customers only confirm the details of their last order instead of being asked for each one
+    def __prefill_from_profile(self, key: str, value: str) -> None:
+        profile = self.__db_helper.customer_profiles.lookup(key, value)
+        if profile is None:
+            return
+        prefilled = {field: profile[field] for field in profile if self.__order_holder.get(field) is None}
+        if not prefilled:
+            return
+        for field, field_value in prefilled.items():
+            self.__order_holder[field] = field_value
+            self.__prefilled_fields.add(field)
+            self.__log_event("order_update", {"key": field, "value": field_value, "prefilled": True})
+        prefilled_text = ", ".join(f"{field} = {self.__shown(field)}" for field in prefilled)
+        self.__add_to_chat_history('assistant',
+                                   f"Returning customer, order updated from their last order: {prefilled_text}")
+
+    # someone else could have given this phone number or email, so the name and contact details that came from
+    # the order on file aren't read back whole
+    def __shown(self, field: str) -> str:
+        value = self.__order_holder[field]
+        if field in self.__prefilled_fields and field in customer_profiles.MASKED_FIELDS:
+            return customer_profiles.mask(field, value)
+        return value
 
-        for section in db_menu:
-            beer_menu = section.get("beer_menu", {})
-            food_menu = section.get("food_menu", {})
+    def __order_items_total_calculator(self, order_items: dict) -> dict:
+        menu = self.__db_helper.get_menu_snapshot()
+        beer_menu = menu.beer_menu
+        food_menu = menu.food_menu
 
         for item in order_items.keys():
             # beer check
@@ -126,58 +249,51 @@ class AIAssistant:
         return total
 
     # this is where all chat with the user flows in
-    def bot_entry_point(self, *args):
+    # merged_turn is set when several buffered user messages were joined into a single input
+    # turn_deadline is the time budget for the whole turn, TURN_SLO_SECONDS from now when not given
+    def bot_entry_point(self, *args, merged_turn: bool = False, turn_deadline: deadline.Deadline | None = None):
+        turn_start = time.perf_counter()
+        turn_deadline = turn_deadline if turn_deadline is not None else deadline.Deadline.from_slo()
+        if args:
+            self.__log_event("user_input", {"text": args[0], "merged": merged_turn})
+        response = self.__respond(*args, merged_turn=merged_turn, turn_deadline=turn_deadline)
+        self.__log_event("response", {"text": response})
+        # summarizing old chat is the least urgent work in a turn, so it happens last
+        self.__prune_chat_history(turn_deadline)
+        if not self.dry_run:
+            self.__record_turn_metrics(turn_deadline, time.perf_counter() - turn_start)
+        return response
+
+    @staticmethod
+    def __record_turn_metrics(turn_deadline: deadline.Deadline, turn_seconds: float) -> None:
+        metrics.turn_metrics.increment("turns")
+        metrics.turn_metrics.increment("turn_seconds_total", turn_seconds)
+        if turn_deadline.expired():
+            metrics.turn_metrics.increment("turns_over_slo")
+        if turn_deadline.degraded_stages:
+            metrics.turn_metrics.increment("turns_degraded")
+            for stage in turn_deadline.degraded_stages:
+                metrics.turn_metrics.increment(f"degraded_stage:{stage}")
+
+    def __respond(self, *args, merged_turn: bool = False, turn_deadline: deadline.Deadline | None = None):
 
         # Initial welcome message
+        # the menu is rendered once when it is loaded, no need to ask the model to format it every time
         if len(self.__chat_holder) == 0:
-            response = openai.ChatCompletion.create(
-                model=self.__MODEL,
-                messages=[
-                    {"role": "system",
-                     "content": "You are a helpful assistant that answers questions about the brewpub. "
-                                "Give the user a short greeting and ask them what they would like to order from "
-                                "the menu. Give them a nicely formatted output of the menu. The menu is as follows: \n"
-                                "###\n"
-                                f"{self.__db_helper.get_menu()}\n"
-                                "###\n"
-                     }
-                ],
-                temperature=0.0,
-                max_tokens=1000,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0
-            )
-            response = response['choices'][0]['message']['content']
+            response = self.__db_helper.get_menu_snapshot().rendered
             self.__add_to_chat_history('assistant', "Hello, welcome to the brewpub. How can I help you?")
             return response
 
         elif self.__order_complete_flag:
-            order_verification = openai.ChatCompletion.create(
-                model=self.__MODEL,
+            order_verification = self.__router.complete(
+                "order_verification",
+                turn_deadline=turn_deadline,
                 messages=[
                     {"role": "system",
                      "content": "You are a system designed to determine the sentiment of the user. "
                                 "The user will tell you if they accept their order or not. "
                                 "You will output only \"yes\" if they accept or \"no\" if they do not accept."},
-                    {"role": "user", "content": "Yes, that order is correct."},
-                    {"role": "assistant", "content": "yes"},
-                    {"role": "user", "content": "Can I change my order?"},
-                    {"role": "assistant", "content": "no"},
-                    {"role": "user", "content": "yes"},
-                    {"role": "assistant", "content": "yes"},
-                    {"role": "user", "content": "no"},
-                    {"role": "assistant", "content": "no"},
-                    {"role": "user", "content": "Actually, can I get"},
-                    {"role": "assistant", "content": "no"},
-                    {"role": "user", "content": "Please submit my order."},
-                    {"role": "assistant", "content": "yes"},
-                    {"role": "user", "content": "I want something else"},
-                    {"role": "assistant", "content": "no"},
-                    {"role": "user", "content": "Can I add..."},
-                    {"role": "assistant", "content": "no"},
-                    {"role": "user", "content": "Can I get..."},
-                    {"role": "assistant", "content": "no"},
+                    *self.__few_shot.examples("order_verification", args[0]),
                     {"role": "user", "content": f"{args[0]}"},
                 ],
                 temperature=0.0,
@@ -186,7 +302,6 @@ class AIAssistant:
                 frequency_penalty=0,
                 presence_penalty=0
             )
-            order_verification = order_verification['choices'][0]['message']['content']
             # print(f"Order verification: {order_verification}")
             if order_verification == "yes":
                 output_msg = self.__submit_order(self.__order_holder)
@@ -194,6 +309,7 @@ class AIAssistant:
                 output_msg = ("Tell me what you would like to change. "
                               "If changing the food items, please restate all food items in your order.")
                 self.__order_complete_flag = False
+                self.__log_event("order_flag", {"complete": False})
 
             self.__add_to_chat_history('assistant', output_msg)
             return output_msg
@@ -212,14 +328,20 @@ class AIAssistant:
             self.__add_to_chat_history('user', user_input)
 
             # run all extractors before feeding input to the classifier
-            # if something is extracted, no need to run subsequent extractors
+            # if something is extracted, no need to run subsequent extractors,
+            # unless the input is several merged messages that can each carry a different field
+            extracted_slots = {}
             for extractor in extractor_list:
-                result = extractor(user_prompt=user_input)
+                result = extractor(user_prompt=user_input, turn_deadline=turn_deadline)
                 if result is not None:
-                    break
+                    extracted_slots[extractor.__name__.strip("_")] = result
+                    if not merged_turn:
+                        break
+            self.__log_event("slots", extracted_slots)
 
             # classify the user input
-            self.__convo_intent = self.__intent_chooser(user_input)
+            self.__convo_intent = self.__intent_chooser(user_input, turn_deadline)
+            self.__log_event("intent", {"intent": self.__convo_intent})
             # print("Convo intent: ", self.__convo_intent)
 
             # three main three main conversation paths
@@ -229,26 +351,40 @@ class AIAssistant:
                     self.__print_chat_history()
                     return output_msg
                 case "get menu":
+                    output_msg = self.__menu_question_entry_point(user_input, turn_deadline)
                     self.__print_chat_history()
-                    # TODO: add API call to take in the menu from the DB and output a nicely formatted menu
-                    return "Here is the menu...."
+                    return output_msg
                 case "question answer":
-                    question_answer = self.__general_questions_entry_point(user_input)
+                    question_answer = self.__general_questions_entry_point(user_input, turn_deadline)
                     self.__print_chat_history()
                     return question_answer
                 case _:
-                    default_response = self.__just_a_nice_response(user_input, self.__convo_intent)
+                    default_response = self.__just_a_nice_response(user_input, self.__convo_intent, turn_deadline)
                     self.__print_chat_history()
                     return f"PLACE HOLDER: {default_response}"
 
+    # several user messages sent back to back are answered as one turn,
+    # so the extractors and the intent classifier only run once for the whole batch
+    def bot_batch_entry_point(self, user_inputs: List[str]) -> List[str]:
+        responses = []
+        if len(self.__chat_holder) == 0:
+            responses.append(self.bot_entry_point())
+        user_inputs = [user_input.strip() for user_input in user_inputs if user_input.strip()]
+        if len(user_inputs) == 1:
+            responses.append(self.bot_entry_point(user_inputs[0]))
+        elif len(user_inputs) > 1:
+            responses.append(self.bot_entry_point("\n".join(user_inputs), merged_turn=True))
+        return responses
+
     def __ask_for_missing_order_info(self, *args) -> str:
         output_msg = ""
         if self.__order_holder['order_items'] is None:
             output_msg = "What would you like to order?"
-        elif self.__order_holder['user_name'] is None:
-            output_msg = "What name will this order be under?"
+        # the phone number comes first, for returning customers it fills in everything else
         elif self.__order_holder['user_phone'] is None:
             output_msg = "What phone number should we use to contact you when the order is ready?"
+        elif self.__order_holder['user_name'] is None:
+            output_msg = "What name will this order be under?"
         elif self.__order_holder['user_email'] is None:
             output_msg = "What email address would you like to receive updates at?"
         elif self.__order_holder['payment_method'] is None:
@@ -260,9 +396,11 @@ class AIAssistant:
         self.__add_to_chat_history('assistant', output_msg)
         return output_msg
 
-    def __order_items_extractor(self, user_prompt: str) -> dict | None:
-        order_items = openai.ChatCompletion.create(
-            model=self.__MODEL,
+    def __order_items_extractor(self, user_prompt: str, turn_deadline: deadline.Deadline | None = None) -> dict | None:
+        order_items = self.__router.complete(
+            "order_items_extractor",
+            turn_deadline=turn_deadline,
+            fallback=self.__local_order_items_extractor,
             messages=[
                 {"role": "system",
                  "content": "You are a system whose purpose is to extract the items from an order and the quantity "
@@ -273,33 +411,7 @@ class AIAssistant:
                             "\"SECOND ITEM NAME\": {\"item_qty\": INTEGER}}"
                             "\n###\n"
                             "If no food items are ordered, return ```None```."},
-                {"role": "user", "content": "I'd like to order 2 cheeseburgers and 3 fries."},
-                {"role": "assistant",
-                 "content": "{\"cheeseburger\": {\"item_qty\": 2}, \"fries\": {\"item_qty\": 3}}"},
-                {"role": "user", "content": "Can I please get one apple pie and one blueberry tart?"},
-                {"role": "assistant",
-                 "content": "{\"apple pie\": {\"item_qty\": 1}, \"blueberry tart\": {\"item_qty\": 1}}"},
-                {"role": "user", "content": "I'm done eating. Let's go to the movies and then head home."},
-                {"role": "assistant", "content": "None"},
-                {"role": "user", "content": "I'll take 10 beef tacos, and he'll have five chicken quesadillas."},
-                {"role": "assistant",
-                 "content": "{\"beef taco\": {\"item_qty\": 10}, \"chicken quesadilla\": {\"item_qty\": 5}}"},
-                {"role": "user",
-                 "content": "We'd like to order 2 chicken buckets, 5 dinner rolls, a side of mac n' cheese, "
-                            "a side of mashed potatoes, and 2 fudge brownies."},
-                {"role": "assistant",
-                 "content": "{\"chicken bucket\": {\"item_qty\": 2}, "
-                            "\"dinner rolls\": {\"item_qty\": 5}, "
-                            "\"mac n' cheese\": {\"item_qty\": 1}, "
-                            "\"mashed potatoes\": {\"item_qty\": 1}}"},
-                {"role": "user", "content": "can i get two large fries and 5 orders of chicken nuggets?"},
-                {"role": "assistant",
-                 "content": "{\"large fries\": {\"item_qty\": 2}, \"chicken nuggets\": {\"item_qty\": 5}}"},
-                {"role": "user",
-                 "content": "I forgot what I want to order. Maybe I will come back later and get a brownie."},
-                {"role": "assistant", "content": "None"},
-                {"role": "user", "content": "I'd like to place an order."},
-                {"role": "assistant", "content": "None"},
+                *self.__few_shot.examples("order_items_extractor", user_prompt),
                 {'role': 'user', 'content': f'{user_prompt}'}
             ],
             temperature=0.5,
@@ -308,31 +420,34 @@ class AIAssistant:
             frequency_penalty=0,
             presence_penalty=0
         )
-        order_items = order_items['choices'][0]['message']['content']
         if order_items == "None":
             return None
         try:
             order_items = json.loads(order_items)
         except json.decoder.JSONDecodeError:
             return None
-        order_items = self.__order_items_gpt_cross_check(order_items)
+        order_items = self.__order_items_gpt_cross_check(order_items, turn_deadline)
         order_items = self.__order_items_total_calculator(order_items)
         self.__order_update("order_items", order_items)
         return order_items
 
-    def __order_items_gpt_cross_check(self, order_items: dict) -> dict:
-        beer_menu = {}
-        food_menu = {}
-        db_menu = json.loads(self.__db_helper.get_menu())
-        output_items = {}
+    # used when the turn has no time left for the model, only picks up items named as they are on the menu
+    def __local_order_items_extractor(self, user_prompt: str) -> str:
+        menu = self.__db_helper.get_menu_snapshot()
+        order_items = local_rules.order_items(user_prompt, [item["name"] for item in menu.items()])
+        return "None" if order_items is None else json.dumps(order_items)
 
-        for section in db_menu:
-            beer_menu = section.get("beer_menu", {})
-            food_menu = section.get("food_menu", {})
+    def __order_items_gpt_cross_check(self, order_items: dict, turn_deadline: deadline.Deadline | None = None) -> dict:
+        menu = self.__db_helper.get_menu_snapshot()
+        beer_menu = menu.beer_menu
+        food_menu = menu.food_menu
+        output_items = {}
 
         for item in order_items:
-            determination = openai.ChatCompletion.create(
-                model=self.__MODEL,
+            determination = self.__router.complete(
+                "order_items_cross_check",
+                turn_deadline=turn_deadline,
+                fallback=lambda item_name: self.__closest_menu_item(item_name, menu),
                 messages=[
                     {"role": "system",
                      "content": "You are a system whose purpose is to cross check whether an item in the order is "
@@ -343,20 +458,7 @@ class AIAssistant:
                                 f"\nThe beer menu is:\n```\n{beer_menu}\n```\n"
                                 f"The food menu is:\n```\n{food_menu}\n```"
                      },
-                    {"role": "user", "content": "cheeseburger"},
-                    {"role": "assistant", "content": "Classic Cheeseburger"},
-                    {"role": "user", "content": "Loaded Nachos"},
-                    {"role": "assistant", "content": "Loaded Nachos"},
-                    {"role": "user", "content": "mushrom swis burger"},
-                    {"role": "assistant", "content": "Mushroom Swiss Burger"},
-                    {"role": "user", "content": "grilled cheese sandwich"},
-                    {"role": "assistant", "content": "None"},
-                    {"role": "user", "content": "Cocacola"},
-                    {"role": "assistant", "content": "None"},
-                    {"role": "user", "content": "Beer"},
-                    {"role": "assistant", "content": "None"},
-                    {"role": "user", "content": "velvet lager"},
-                    {"role": "assistant", "content": "Velvet Lager"},
+                    *self.__few_shot.examples("order_items_cross_check", item),
                     {"role": "user", "content": f"{item}"}
                 ],
                 temperature=0.5,
@@ -365,39 +467,55 @@ class AIAssistant:
                 frequency_penalty=0,
                 presence_penalty=0
             )
-            determination = determination['choices'][0]['message']['content']
             if determination == "None":
                 output_items[item] = None
             else:
                 output_items[determination] = order_items[item]
         return output_items
 
+    # deterministic stand-in for the cross check, spelling mistakes within difflib's default cutoff are corrected
+    @staticmethod
+    def __closest_menu_item(item: str, menu) -> str:
+        names = {item_details["name"].lower(): item_details["name"] for item_details in menu.items()}
+        closest = difflib.get_close_matches(item.lower(), names.keys(), n=1)
+        return names[closest[0]] if closest else "None"
+
     ##################################################
     ################ CONVO FUNCTIONS  ################
     ##################################################
     def __add_to_chat_history(self, input_role: str, input_msg: str) -> None:
         self.__chat_holder.append({'role': input_role, 'content': input_msg})
-        self.__prune_chat_history()
-
-    def __prune_chat_history(self) -> None:
-        if len(self.__chat_holder) > self.__CHAT_HISTORY_LENGTH:
-            response = openai.ChatCompletion.create(
-                model=self.__MODEL,
-                messages=[
-                    self.__chat_holder.pop(0),
-                    self.__chat_holder.pop(0),
-                    self.__chat_holder.pop(0),
-                    {'role': 'user',
-                     'content': f'Summarize the main facts in the above chat in {self.__SUMMARY_LENGTH} words or less.'},
-                ],
-                max_tokens=1000
-            )
-            response = response['choices'][0]['message']['content']
+        self.__log_event("chat", {"role": input_role, "content": input_msg})
+
+    # when the turn is out of time the history is left as is, the next turn will try again
+    def __prune_chat_history(self, turn_deadline: deadline.Deadline | None = None) -> None:
+        summarized = False
+        while len(self.__chat_holder) > self.__CHAT_HISTORY_LENGTH:
+            try:
+                response = self.__router.complete(
+                    "summarizer",
+                    turn_deadline=turn_deadline,
+                    messages=[
+                        *self.__chat_holder[:3],
+                        {'role': 'user',
+                         'content': f'Summarize the main facts in the above chat in {self.__SUMMARY_LENGTH} words '
+                                    f'or less.'},
+                    ],
+                    max_tokens=1000
+                )
+            except deadline.DeadlineExceeded:
+                break
+            del self.__chat_holder[:3]
             self.__chat_holder.insert(0, {'role': 'system', 'content': f'Previous chat summary: {response}'})
-
-    def __intent_chooser(self, user_prompt: str) -> str:
-        response = openai.ChatCompletion.create(
-            model=self.__MODEL,
+            self.__log_event("chat_summary", {"summary": response})
+            summarized = True
+        if summarized:
+            self.__start_session()
+
+    def __intent_chooser(self, user_prompt: str, turn_deadline: deadline.Deadline | None = None) -> str:
+        response = self.__router.complete(
+            "intent",
+            turn_deadline=turn_deadline,
             messages=[
                 {"role": "system",
                  "content": "You are a system that assigns an intent to the user's input. "
@@ -415,32 +533,7 @@ class AIAssistant:
                             "\"user_phone\": The user's phone number,\n\"user_email\": The user's email,\n"
                             "\"payment_method\": The user's payment method,\n}\n"
                             "###"},
-                {"role": "user", "content": "can I take a look at the menu?"},
-                {"role": "assistant", "content": "get menu"},
-                {"role": "user", "content": "When are you guys open?"},
-                {"role": "assistant", "content": "question answer"},
-                {"role": "user", "content": "id like to place an order to be picked up."},
-                {"role": "assistant", "content": "order food"},
-                {"role": "user", "content": "can I get a cheeseburger?"},
-                {"role": "assistant", "content": "order food"},
-                {"role": "user", "content": "What beer do you guys have?"},
-                {"role": "assistant", "content": "get menu"},
-                {"role": "user", "content": "jimbob@gmail.com"},
-                {"role": "assistant", "content": "order food"},
-                {"role": "user", "content": "897-888-1256"},
-                {"role": "assistant", "content": "order food"},
-                {"role": "user", "content": "I want to pay with cash."},
-                {"role": "assistant", "content": "order food"},
-                {"role": "user", "content": "Do you guys have grilled cheese?"},
-                {"role": "assistant", "content": "get menu"},
-                {"role": "user", "content": "when are you guys open?"},
-                {"role": "assistant", "content": "question answer"},
-                {"role": "user", "content": "Is there a steak on the menu?"},
-                {"role": "assistant", "content": "get menu"},
-                {"role": "user", "content": "John Smith"},
-                {"role": "assistant", "content": "order food"},
-                {"role": "user", "content": "my phone number is 888-741-8563"},
-                {"role": "assistant", "content": "order food"},
+                *self.__few_shot.examples("intent", user_prompt),
                 {"role": "user", "content": f"{user_prompt}"}
             ],
             temperature=0,
@@ -449,14 +542,22 @@ class AIAssistant:
             frequency_penalty=0,
             presence_penalty=0
         )
-        response = response['choices'][0]['message']['content']
         # self.__add_to_chat_history('system', f"Current intent: {response}")
         return response
 
-    def __just_a_nice_response(self, user_prompt: str, convo_intent: str) -> str:
+    # out of time in the middle of an order, asking for the next missing field keeps the order moving
+    def __just_a_nice_response(self, user_prompt: str, convo_intent: str,
+                              turn_deadline: deadline.Deadline | None = None) -> str:
+        order_in_progress = any(value is not None for value in self.__order_holder.values())
+        if not self.__router.can_afford("nice_response", turn_deadline):
+            turn_deadline.degrade("nice_response")
+            return self.__nice_response_fallback(order_in_progress)
+
         if convo_intent == "order food":
-            response = openai.ChatCompletion.create(
-                model=self.__MODEL,
+            response = self.__router.complete(
+                "nice_response",
+                turn_deadline=turn_deadline,
+                fallback=lambda _: None,
                 messages=[
                     {"role": "system",
                      "content": "You are a nice assistant that responds to the user's input and "
@@ -471,13 +572,16 @@ class AIAssistant:
                 frequency_penalty=0,
                 presence_penalty=0
             )
-            response = response['choices'][0]['message']['content']
+            if response is None:
+                return self.__nice_response_fallback(order_in_progress)
             self.__add_to_chat_history('assistant', response)
             return response
 
         else:
-            response = openai.ChatCompletion.create(
-                model=self.__MODEL,
+            response = self.__router.complete(
+                "nice_response",
+                turn_deadline=turn_deadline,
+                fallback=lambda _: None,
                 messages=[
 
                     {"role": "system",
@@ -491,10 +595,18 @@ class AIAssistant:
                 frequency_penalty=0,
                 presence_penalty=0
             )
-            response = response['choices'][0]['message']['content']
+            if response is None:
+                return self.__nice_response_fallback(order_in_progress)
             self.__add_to_chat_history('assistant', response)
             return response
 
+    # the complete calls above return None when they time out
+    def __nice_response_fallback(self, order_in_progress: bool) -> str:
+        if order_in_progress:
+            return self.__ask_for_missing_order_info()
+        self.__add_to_chat_history('assistant', self.__NICE_RESPONSE_FALLBACK)
+        return self.__NICE_RESPONSE_FALLBACK
+
     ##################################################
     ################ ORDER FUNCTIONS ################
     ##################################################
@@ -503,15 +615,16 @@ class AIAssistant:
         user_conformation = ""
         order_items_string = ""
         self.__order_holder['order_total'] = self.__order_total_calculator(self.__order_holder)
+        self.__log_event("order_update", {"key": "order_total", "value": self.__order_holder['order_total']})
         for item, details in self.__order_holder['order_items'].items():
             item_name = item
             item_qty = details['item_qty']
             order_items_string += f"  - {item} x {details['item_qty']}\n"
 
         output_msg = f"Please confirm your order: \n" \
-                     f"- Name: {self.__order_holder['user_name']}\n" \
-                     f"- Phone: {self.__order_holder['user_phone']}\n" \
-                     f"- Email: {self.__order_holder['user_email']}\n" \
+                     f"- Name: {self.__shown('user_name')}\n" \
+                     f"- Phone: {self.__shown('user_phone')}\n" \
+                     f"- Email: {self.__shown('user_email')}\n" \
                      f"- Payment Method: {self.__order_holder['payment_method']}\n" \
                      f"- Order Items:\n" \
                      f"{order_items_string}" \
@@ -521,28 +634,16 @@ class AIAssistant:
         self.__add_to_chat_history('assistant', output_msg)
         return output_msg
 
-    def __user_name_extractor(self, user_prompt: str) -> str | None:
-        user_name = response = openai.ChatCompletion.create(
-            model=self.__MODEL,
+    def __user_name_extractor(self, user_prompt: str, turn_deadline: deadline.Deadline | None = None) -> str | None:
+        user_name = self.__router.complete(
+            "user_name_extractor",
+            turn_deadline=turn_deadline,
             messages=[
                 {"role": "system",
                  "content": "You are a system whose purpose is to extract the name from a string of text. "
                             "You will output only the name of the user and nothing else. "
                             "If a name cannot be found, output \"\"\"None\"\"\"."},
-                {"role": "user", "content": "My name is Preston."},
-                {"role": "assistant", "content": "Preston"},
-                {"role": "user", "content": "Hi, my name is Sandra, but you can call me Sandy."},
-                {"role": "assistant", "content": "Sandy"},
-                {"role": "user", "content": "can I get a towel?"},
-                {"role": "assistant", "content": "None"},
-                {"role": "user", "content": "im looking for an order. It should be under the name debra waters"},
-                {"role": "assistant", "content": "Debra Waters"},
-                {"role": "user", "content": "what time is it right now?"},
-                {"role": "assistant", "content": "None"},
-                {"role": "user", "content": "did you see lauren land that crazy high jump the other day?"},
-                {"role": "assistant", "content": "Lauren"},
-                {"role": "user", "content": "Hey, this is Dean. Can I place an order to be picked up?"},
-                {"role": "assistant", "content": "Dean"},
+                *self.__few_shot.examples("user_name_extractor", user_prompt),
                 {"role": "user", "content": f"{user_prompt}"}
             ],
             temperature=0.5,
@@ -551,39 +652,22 @@ class AIAssistant:
             frequency_penalty=0,
             presence_penalty=0
         )
-        user_name = user_name['choices'][0]['message']['content']
         if user_name == "None":
             return None
         else:
             self.__order_update("user_name", user_name)
             return user_name
 
-    def __user_phone_extractor(self, user_prompt: str) -> str | None:
-        user_phone = openai.ChatCompletion.create(
-            model=self.__MODEL,
+    def __user_phone_extractor(self, user_prompt: str, turn_deadline: deadline.Deadline | None = None) -> str | None:
+        user_phone = self.__router.complete(
+            "user_phone_extractor",
+            turn_deadline=turn_deadline,
             messages=[
                 {"role": "system",
                  "content": "You are a system whose purpose is to extract the phone number from a string of text."
                             "You will output only the phone number of the user and nothing else. "
                             "If a phone number cannot be found, output \"\"\"000-000-0000\"\"\"."},
-                {"role": "user", "content": "My phone number is 123-456-7890."},
-                {"role": "assistant", "content": "123-456-7890"},
-                {"role": "user", "content": "hey, can you call be back at 8529517536?"},
-                {"role": "assistant", "content": "852-951-7536"},
-                {"role": "user", "content": "Do you know Brad's phone number?"},
-                {"role": "assistant", "content": "000-000-0000"},
-                {"role": "user",
-                 "content": "you've reached Bill at 741-124-8965, please leave a message and I'll get back to you."},
-                {"role": "assistant", "content": "741-124-8965"},
-                {"role": "user", "content": "what time is it right now?"},
-                {"role": "assistant", "content": "000-000-0000"},
-                {"role": "user", "content": "I tried calling John at 9996582350, but no one picked up."},
-                {"role": "assistant", "content": "999-658-2350"},
-                {"role": "user", "content": "Do you remember Janice's phone number? I think I have the wrong one."},
-                {"role": "assistant", "content": "000-000-0000"},
-                {"role": "user", "content": "If you have any questions, "
-                                            "feel free to reach out to me at (555) 123-4567."},
-                {"role": "assistant", "content": "555-123-4567"},
+                *self.__few_shot.examples("user_phone_extractor", user_prompt),
                 {"role": "user", "content": f"{user_prompt}"}
             ],
             temperature=0.5,
@@ -592,47 +676,24 @@ class AIAssistant:
             frequency_penalty=0,
             presence_penalty=0
         )
-        user_phone = user_phone['choices'][0]['message']['content']
         if user_phone == "000-000-0000":
             return None
         else:
             self.__order_update("user_phone", user_phone)
             return user_phone
 
-    def __payment_method_extractor(self, user_prompt: str) -> str | None:
-        payment_method = openai.ChatCompletion.create(
-            model=self.__MODEL,
+    def __payment_method_extractor(self, user_prompt: str,
+                                   turn_deadline: deadline.Deadline | None = None) -> str | None:
+        payment_method = self.__router.complete(
+            "payment_method_extractor",
+            turn_deadline=turn_deadline,
             messages=[
                 {"role": "system",
                  "content": "You are a system whose purpose is to extract the payment method from a string of text. "
                             "You will output only the payment method of the user and nothing else. "
                             "If a payment method cannot be found, output \"\"\"None\"\"\". "
                             "The three payment methods are:\nCash,\nCard,\nBoth"},
-                {"role": "user", "content": "I'll be paying with cash."},
-                {"role": "assistant", "content": "Cash"},
-                {"role": "user", "content": "My debit card number is 1234 5678 9012 3456."},
-                {"role": "assistant", "content": "Card"},
-                {"role": "user", "content": "can you put it on my credit card?"},
-                {"role": "assistant", "content": "Card"},
-                {"role": "user", "content": "I'll pay for it tomorrow."},
-                {"role": "assistant", "content": "None"},
-                {"role": "user", "content": "I'm ready to make a purchase. "
-                                            "What payment options do you accept – cash or card?"},
-                {"role": "assistant", "content": "Both"},
-                {"role": "user", "content": "Is it possible to split the bill between cash and card payments "
-                                            "for our dinner tonight?"},
-                {"role": "assistant", "content": "Both"},
-                {"role": "user", "content": "I'm planning to attend the event. Should I bring cash for tickets?"},
-                {"role": "assistant", "content": "Cash"},
-                {"role": "user", "content": "Do you know if the store down the road takes card?"},
-                {"role": "assistant", "content": "Card"},
-                {"role": "user", "content": "I don't have my card with me. Can I pay with cash?"},
-                {"role": "assistant", "content": "Cash"},
-                {"role": "user", "content": "do you guys take cash?"},
-                {"role": "assistant", "content": "Cash"},
-                {"role": "user", "content": "I'm not sure if I should pay with cash or card. "
-                                            "I think this time I will use my card. I want to get the points."},
-                {"role": "assistant", "content": "Card"},
+                *self.__few_shot.examples("payment_method_extractor", user_prompt),
                 {"role": "user", "content": f"{user_prompt}"}
             ],
             temperature=0.5,
@@ -641,16 +702,16 @@ class AIAssistant:
             frequency_penalty=0,
             presence_penalty=0
         )
-        payment_method = payment_method['choices'][0]['message']['content']
         if payment_method == "None":
             return None
         else:
             self.__order_update("payment_method", payment_method)
             return payment_method
 
-    def __user_email_extractor(self, user_prompt: str) -> str | None:
-        user_email = openai.ChatCompletion.create(
-            model=self.__MODEL,
+    def __user_email_extractor(self, user_prompt: str, turn_deadline: deadline.Deadline | None = None) -> str | None:
+        user_email = self.__router.complete(
+            "user_email_extractor",
+            turn_deadline=turn_deadline,
             messages=[
                 {"role": "system",
                  "content": "You are a system whose purpose is to extract the email from a string of text. "
@@ -662,38 +723,7 @@ class AIAssistant:
                             "\n@aol.com,\n@icloud.com,\n@mail.com,\n@protonmail.com,\n@yandex.com,\n@gmx.com,"
                             "\n@zoho.com\n"
                             "###"},
-                {"role": "user",
-                 "content": "Could you please send me the details at john.doe@example.com? "
-                            "I'm looking forward to reviewing the information."},
-                {"role": "assistant", "content": "john.doe@example.com"},
-                {"role": "user",
-                 "content": "I'll be available for the call tomorrow. "
-                            "You can reach me at sarah.smith@emailprovider.net. Thanks!"},
-                {"role": "assistant", "content": "sarah.smith@emailprovider.net"},
-                {"role": "user",
-                 "content": "If you have any questions, don't hesitate to email me at info@companyname.com. "
-                            "I'll be glad to assist you."},
-                {"role": "assistant", "content": "info@companyname.com"},
-                {"role": "user",
-                 "content": "can you please send me your email. "
-                            "I want to forward you the message the supervisor sent."},
-                {"role": "assistant", "content": "None"},
-                {"role": "user",
-                 "content": "The document is attached. Let me know if you need any changes. "
-                            "My email is jane.roberts@gmail.com."},
-                {"role": "assistant", "content": "jane.roberts@gmail.com"},
-                {"role": "user",
-                 "content": "I'd like to subscribe to your newsletter. "
-                            "Please add me using my personal address: news.subscriber@hotmail.com."},
-                {"role": "assistant", "content": "news.subscriber@hotmail.com"},
-                {"role": "user",
-                 "content": "is your email mikejones@gmail.com? I keep getting a \"no delivered\" error."},
-                {"role": "assistant", "content": "mikejones@gmail.com"},
-                {"role": "user",
-                 "content": "can you please forward that message to fakeemail@outlook.com? I want to save it."},
-                {"role": "assistant", "content": "fakeemail@outlook.com"},
-                {"role": "user", "content": "My name is Sarah Silverman."},
-                {"role": "assistant", "content": "None"},
+                *self.__few_shot.examples("user_email_extractor", user_prompt),
                 {"role": "user", "content": f"{user_prompt}"}
             ],
             temperature=0,
@@ -702,37 +732,79 @@ class AIAssistant:
             frequency_penalty=0,
             presence_penalty=0
         )
-        user_email = user_email['choices'][0]['message']['content']
         if user_email == "None":
             return None
         else:
             self.__order_update("user_email", user_email)
             return user_email
 
+    ##################################################
+    ################# MENU QUESTIONS #################
+    ##################################################
+
+    # Existence, listing and price questions are answered from the menu itself.
+    # Only open-ended questions ("what goes well with a stout?") go to the model.
+    def __menu_question_entry_point(self, user_prompt: str, turn_deadline: deadline.Deadline | None = None) -> str:
+        menu = self.__db_helper.get_menu_snapshot()
+        response = menu.query_engine.answer(user_prompt)
+        if response is None:
+            response = self.__router.complete(
+                "menu_answer",
+                turn_deadline=turn_deadline,
+                # out of time for an open-ended answer, the whole menu still answers the question
+                fallback=lambda _: menu.text,
+                messages=[
+                    {'role': 'system',
+                     'content': f'You are a helpful assistant at a brewpub. '
+                                f'The menu is:\n```\n{menu.text}\n```\n'
+                                'Answer the user\'s question about the menu concisely. '
+                                'Only mention items on the menu.'},
+                    {'role': 'user', 'content': f'{user_prompt}'}
+                ],
+                temperature=0.5,
+                max_tokens=300
+            )
+        self.__add_to_chat_history('assistant', response)
+        return response
+
     ##################################################
     ################ GENERAL QUESTIONS ###############
     ##################################################
 
     # Classifies the question and returns the classification.
     # Classification is based on fields found in the FAQ collection.
-    def __get_general_question_classification(self, user_prompt: str) -> str:
-        question_classification = openai.ChatCompletion.create(
-            model=self.__MODEL,
+    # The field names are read on every call, the handler caches them and a refresh reaches live assistants.
+    def __get_general_question_classification(self, user_prompt: str,
+                                              turn_deadline: deadline.Deadline | None = None) -> str:
+        general_question_classifications = self.__db_helper.get_all_field_names("FAQ")
+        question_classification = self.__router.complete(
+            "faq_classification",
+            turn_deadline=turn_deadline,
+            fallback=lambda _: "NONE",
             messages=[
                 {'role': 'system',
                  'content': f'Determine the classification of the following question and choose '
-                            f'from {self.__general_question_classifications} or NONE'},
+                            f'from {general_question_classifications} or NONE'},
                 {'role': 'user', 'content': f'{user_prompt}'},
             ],
             max_tokens=500
         )
-        question_classification = question_classification['choices'][0]['message']['content']
         # print(f"General Question Classification: {question_classification}")
         return question_classification
 
     # Returns a response to a general question.
-    def __general_questions_entry_point(self, user_prompt: str) -> str:
-        prompt_classification = self.__get_general_question_classification(user_prompt)
+    # The classification and the answer are two model calls, when the turn can't fit both the
+    # customer is pointed to the brewery directly instead.
+    def __general_questions_entry_point(self, user_prompt: str,
+                                        turn_deadline: deadline.Deadline | None = None) -> str:
+        faq_seconds = (self.__router.estimated_seconds("faq_classification")
+                       + self.__router.estimated_seconds("faq_answer"))
+        if turn_deadline is not None and not turn_deadline.has(faq_seconds):
+            turn_deadline.degrade("faq")
+            response = self.__FAQ_UNAVAILABLE_RESPONSE
+            self.__add_to_chat_history('assistant', response)
+            return response
+        prompt_classification = self.__get_general_question_classification(user_prompt, turn_deadline)
         if prompt_classification == "NONE":
             message = [
                 {'role': 'system',
@@ -754,11 +826,12 @@ class AIAssistant:
                             'contact the brewery directly.'},
                 {'role': 'user', 'content': f'{user_prompt}'}
             ]
-        response = openai.ChatCompletion.create(
-            model=self.__MODEL,
+        response = self.__router.complete(
+            "faq_answer",
+            turn_deadline=turn_deadline,
+            fallback=lambda _: self.__FAQ_UNAVAILABLE_RESPONSE,
             messages=message,
             max_tokens=500
         )
-        response = response['choices'][0]['message']['content']
         self.__add_to_chat_history('assistant', response)
         return response
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from app import ai_assistant as assist
+from app import event_log
+from app import settings
+
+# transcripts are independent conversations, so they can be replayed side by side.
+# the work is almost entirely waiting on the OpenAI API, threads are enough here.
+DEFAULT_REPLAY_WORKERS = 8  # REPLAY_WORKERS overrides it
+
+
+def replay_transcript(assistant: assist.AIAssistant, transcript: List[str | List[str]]) -> List[str]:
+    """
+    Replays one recorded conversation against a fresh assistant.
+    :param assistant: dry_run assistant with no chat history yet.
+    :param transcript: user turns in order. A turn that is a list of messages was buffered by the client and
+                       is answered as a single merged turn.
+    :return: every response the assistant gave, starting with the welcome message.
+    """
+    # a replayed "yes, submit it" must not reach the orders collection, the sales rollups or the kitchen
+    if not assistant.dry_run:
+        raise ValueError("Transcripts can only be replayed on a dry_run assistant.")
+    responses = [assistant.bot_entry_point()]
+    for turn in transcript:
+        if isinstance(turn, list):
+            responses.extend(assistant.bot_batch_entry_point(turn))
+        else:
+            responses.append(assistant.bot_entry_point(turn))
+    return responses
+
+
+def replay_transcripts(transcripts: List[List[str | List[str]]],
+                       assistant_factory: Callable[[], assist.AIAssistant],
+                       max_workers: int | None = None) -> List[List[str]]:
+    """
+    Replays many recorded conversations concurrently, each one on its own assistant.
+    :param transcripts: list of transcripts, see replay_transcript.
+    :param assistant_factory: builds a new dry_run assistant for each transcript.
+    :param max_workers: number of transcripts replayed at the same time, REPLAY_WORKERS by default.
+    :return: the responses for each transcript, in the same order as the input.
+    """
+    if not transcripts:
+        return []
+    if max_workers is None:
+        settings.load_environment()
+        max_workers = int(os.getenv("REPLAY_WORKERS", DEFAULT_REPLAY_WORKERS))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(transcripts)))) as executor:
+        return list(executor.map(lambda transcript: replay_transcript(assistant_factory(), transcript),
+                                 transcripts))
+
+
+def replay_event_log(turn_log: event_log.TurnEventLog,
+                     assistant_factory: Callable[[], assist.AIAssistant],
+                     max_workers: int | None = None) -> Dict[str, List[str]]:
+    """
+    Replays every conversation recorded in a turn event log, e.g. to benchmark a change without live traffic.
+    :param turn_log: log to read the user turns from.
+    :param assistant_factory: builds a new dry_run assistant for each conversation.
+    :param max_workers: number of conversations replayed at the same time, REPLAY_WORKERS by default.
+    :return: the new responses keyed by the session id of the recorded conversation.
+    """
+    transcripts = turn_log.transcripts()
+    responses = replay_transcripts(list(transcripts.values()), assistant_factory, max_workers)
+    return dict(zip(transcripts.keys(), responses))
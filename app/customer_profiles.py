@@ -0,0 +1,133 @@
+import re
+import threading
+from collections import OrderedDict
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+
+def normalise(field: str, value: str | None) -> str:
+    """
+    Returns the form a phone number or email is looked up by: "(555) 123-4567" and "555-123-4567" are the same
+    customer, so are emails that only differ in case. Empty for a missing value.
+    :param field: "user_phone" or "user_email".
+    """
+    if value in (None, "None"):
+        return ""
+    if field == "user_phone":
+        return re.sub(r"[^0-9]", "", value)[-10:]
+    return value.strip().lower()
+
+
+# the details that identify a customer, shown masked when they came from a past order
+MASKED_FIELDS = ("user_name", "user_phone", "user_email")
+
+
+def mask(field: str, value: str) -> str:
+    """
+    Hides most of a name, phone number or email, for details that came from a past order rather than from
+    the customer.
+    :param field: one of MASKED_FIELDS.
+    """
+    if field == "user_phone":
+        return f"***-***-{re.sub(r'[^0-9]', '', value)[-4:]}"
+    if field == "user_name":
+        return " ".join(f"{part[:1]}***" for part in value.split())
+    name, _, domain = value.partition("@")
+    return f"{name[:1]}***@{domain}"
+
+
+class CustomerProfiles:
+    """
+    Contact and payment details of returning customers, looked up by phone number or email.
+    Orders carry the normalised phone and email in KEY_FIELDS, and lookups query those, so every spelling of a
+    number or email finds the same customer.
+    Profiles come from the customer's most recent order, are held in a bounded LRU, and are updated
+    whenever an order is inserted, so a regular's second order in a process never goes to the database.
+    Customers with no past orders are cached too, so asking again doesn't cost a query.
+    """
+    MAX_PROFILES = 10000
+    PROFILE_FIELDS = ("user_name", "user_phone", "user_email", "payment_method")
+    KEY_FIELDS = {"user_phone": "user_phone_key", "user_email": "user_email_key"}
+    __ORDER_FILTER = {"name": {"$ne": "EXAMPLE_ORDER"}}
+
+    def __init__(self, orders, max_profiles: int = MAX_PROFILES):
+        """
+        :param orders: pymongo orders collection.
+        :param max_profiles: most lookup keys kept in memory.
+        """
+        self.orders = orders
+        self.max_profiles = max_profiles
+        self.__profiles = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def ensure_indexes(self) -> None:
+        """
+        Creates the indexes the phone and email lookups rely on, newest order first,
+        and adds the lookup keys to orders written before they existed.
+        """
+        for key_field in self.KEY_FIELDS.values():
+            self.orders.create_index([(key_field, ASCENDING), ("_id", DESCENDING)])
+        self.backfill_keys()
+
+    def backfill_keys(self) -> None:
+        """
+        Adds KEY_FIELDS to the orders that don't have them yet. Every order gets them when it is inserted,
+        so after the first run this only finds orders written by an older version.
+        """
+        # a missing key reads as null, so this uses the key's index
+        missing = self.orders.find({"user_phone_key": None}, {field: 1 for field in self.KEY_FIELDS})
+        updates = [UpdateOne({"_id": order["_id"]}, {"$set": self.lookup_keys(order)}) for order in missing]
+        if updates:
+            self.orders.bulk_write(updates, ordered=False)
+
+    def lookup_keys(self, order: dict) -> dict:
+        """
+        Returns the KEY_FIELDS of an order, stored with it on insert.
+        """
+        return {key_field: normalise(field, order.get(field)) for field, key_field in self.KEY_FIELDS.items()}
+
+    def lookup(self, field: str, value: str) -> dict | None:
+        """
+        Returns the profile of the customer with this phone number or email.
+        :param field: "user_phone" or "user_email".
+        :param value: the value as the extractor returned it.
+        :return: {field: value} for every PROFILE_FIELDS the customer has given before, or None for new customers.
+        """
+        normalised = normalise(field, value)
+        if not normalised:
+            return None
+        key = f"{field}:{normalised}"
+        with self.__lock:
+            if key in self.__profiles:
+                self.__profiles.move_to_end(key)
+                return self.__profiles[key]
+        order = self.orders.find_one({**self.__ORDER_FILTER, self.KEY_FIELDS[field]: normalised},
+                                     {"_id": 0, **{name: 1 for name in self.PROFILE_FIELDS}},
+                                     sort=[("_id", DESCENDING)])
+        profile = self.__profile(order) if order is not None else None
+        with self.__lock:
+            self.__store(key, profile)
+        return profile
+
+    def remember(self, order: dict) -> None:
+        """
+        Updates the cached profile from a newly inserted order.
+        :param order: the order document that was inserted.
+        """
+        if order.get("name") == "EXAMPLE_ORDER":
+            return
+        profile = self.__profile(order)
+        with self.__lock:
+            for field in self.KEY_FIELDS:
+                if normalise(field, profile.get(field)):
+                    self.__store(f"{field}:{normalise(field, profile[field])}", profile)
+
+    @classmethod
+    def __profile(cls, order: dict) -> dict:
+        return {field: order[field] for field in cls.PROFILE_FIELDS if order.get(field) not in (None, "None")}
+
+    def __store(self, key: str, profile: dict | None) -> None:
+        self.__profiles[key] = profile
+        self.__profiles.move_to_end(key)
+        while len(self.__profiles) > self.max_profiles:
+            self.__profiles.popitem(last=False)
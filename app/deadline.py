@@ -0,0 +1,46 @@
+import os
+import time
+from typing import List
+
+from app import settings
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a stage can't finish inside the turn's remaining time budget.
+    """
+
+
+class Deadline:
+    """
+    Time budget for a single conversation turn.
+    Every stage checks the remaining budget before starting work it can skip or do more cheaply,
+    and records that it degraded so the turn can be counted in the metrics.
+    """
+    DEFAULT_SLO_SECONDS = 8.0
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.__expires_at = time.monotonic() + budget_seconds
+        self.degraded_stages: List[str] = []
+
+    @classmethod
+    def from_slo(cls) -> "Deadline":
+        settings.load_environment()
+        return cls(float(os.getenv("TURN_SLO_SECONDS", cls.DEFAULT_SLO_SECONDS)))
+
+    def remaining(self) -> float:
+        return max(0.0, self.__expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def has(self, seconds: float) -> bool:
+        """
+        :param seconds: how long the next piece of work is expected to take.
+        :return: True if it fits in the remaining budget.
+        """
+        return self.remaining() >= seconds
+
+    def degrade(self, stage: str) -> None:
+        self.degraded_stages.append(stage)
@@ -0,0 +1,236 @@
+import fcntl
+import glob
+import json
+import os
+import queue
+import re
+import socket
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+
+class TurnEventLog:
+    """
+    Append-only log of conversation events (user input, extracted slots, intent, responses, order updates).
+    append() only puts the event on a queue, a background thread writes events in batches so logging never
+    sits on the response path. Events go to numbered JSON-lines segment files, or to a capped MongoDB
+    collection when one is given.
+
+    Every process sharing the log claims a worker slot (a flock on worker-N.lock), so with several uvicorn
+    workers each one writes its own segment files and, after a restart, picks up its own last conversations.
+    Each event records its location and its owner: the host, the worker slot and the location it was written by.
+    The host is part of the owner because slots are only unique on one machine, while every machine writes to
+    the same MongoDB collection. In file mode,
+    a small sidecar index keeps each owner's last session and where it starts, so restoring it doesn't scan every
+    segment.
+    """
+    SEGMENT_BYTES = 64 * 1024 * 1024
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 0.5  # seconds
+    CAPPED_COLLECTION_BYTES = 512 * 1024 * 1024
+    MAX_WORKER_SLOTS = 1024
+
+    def __init__(self, directory: str, mongo_db=None, collection_name: str = "turn_events"):
+        """
+        :param directory: folder for the segment files and the worker slot locks.
+        :param mongo_db: pymongo database to write a capped collection into instead of local files.
+        :param collection_name: name of the capped collection.
+        """
+        self.__queue = queue.Queue()
+        self.__collection = None
+        self.__segment = None
+        self.__directory = directory
+        os.makedirs(self.__directory, exist_ok=True)
+        self.__slot_lock = None
+        self.worker_id = self.__claim_worker_slot()
+        # a pod's hostname changes when it is replaced, set TURN_EVENT_LOG_HOST to a stable name to restore across that
+        self.host_id = os.getenv("TURN_EVENT_LOG_HOST") or socket.gethostname()
+        self.__index_path = os.path.join(self.__directory, f"sessions-{self.worker_id}.json")
+        self.__index = {}
+        if mongo_db is not None:
+            if collection_name not in mongo_db.list_collection_names():
+                mongo_db.create_collection(collection_name, capped=True, size=self.CAPPED_COLLECTION_BYTES)
+            self.__collection = mongo_db.get_collection(collection_name)
+            self.__collection.create_index("session_id")
+            self.__collection.create_index([("owner", 1), ("ts", -1)])
+        elif os.path.exists(self.__index_path):
+            with open(self.__index_path, encoding="utf-8") as index_file:
+                self.__index = json.load(index_file)
+        self.__writer = threading.Thread(target=self.__write_loop, name="turn-event-log", daemon=True)
+        self.__writer.start()
+
+    def append(self, session_id: str, seq: int, event_type: str, data: dict, location_id: str | None = None) -> None:
+        """
+        Queues an event to be written. Returns immediately.
+        :param session_id: conversation the event belongs to.
+        :param seq: position of the event in the conversation.
+        :param event_type: what happened, e.g. "user_input", "intent", "order_update".
+        :param data: event payload, must be JSON serializable.
+        :param location_id: location the conversation is at, its assistant restores it after a restart.
+        """
+        self.__queue.put({"session_id": session_id, "seq": seq, "ts": time.time(), "type": event_type,
+                          "location_id": location_id, "owner": self.__owner(location_id), "data": data})
+
+    def close(self) -> None:
+        """
+        Writes out everything still queued and stops the writer thread.
+        """
+        self.__queue.put(None)
+        self.__writer.join()
+        if self.__segment is not None:
+            self.__segment.close()
+            self.__segment = None
+        if self.__slot_lock is not None:
+            self.__slot_lock.close()
+            self.__slot_lock = None
+
+    def __owner(self, location_id: str | None) -> str:
+        owner = f"{self.host_id}/{self.worker_id}"
+        return f"{owner}:{location_id}" if location_id else owner
+
+    # the lock is held until the process exits, so a restarted worker gets a slot a dead one left behind
+    def __claim_worker_slot(self) -> str:
+        for slot in range(self.MAX_WORKER_SLOTS):
+            lock_file = open(os.path.join(self.__directory, f"worker-{slot}.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            self.__slot_lock = lock_file
+            return f"w{slot:03d}"
+        raise RuntimeError("Every turn event log worker slot is taken.")
+
+    ##################################################
+    #################### WRITING #####################
+    ##################################################
+
+    def __write_loop(self) -> None:
+        running = True
+        while running:
+            batch = [self.__queue.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.__queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [event for event in batch if event is not None]
+            if batch:
+                try:
+                    self.__write_batch(batch)
+                except Exception as error:
+                    print(f"Failed to write turn events: \n{error}")
+
+    def __write_batch(self, batch: List[dict]) -> None:
+        if self.__collection is not None:
+            self.__collection.insert_many(batch, ordered=True)
+            return
+        segment = self.__current_segment()
+        segment_name = os.path.basename(segment.name)
+        offset = segment.tell()
+        lines = []
+        index_changed = False
+        for event in batch:
+            line = (json.dumps(event, default=str) + "\n").encode("utf-8")
+            if self.__index.get(event["owner"], {}).get("session_id") != event["session_id"]:
+                self.__index[event["owner"]] = {"session_id": event["session_id"], "segment": segment_name,
+                                                "offset": offset}
+                index_changed = True
+            lines.append(line)
+            offset += len(line)
+        segment.write(b"".join(lines))
+        segment.flush()
+        if index_changed:
+            # written after the events, so the index never points past the end of a segment
+            temporary_path = f"{self.__index_path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as index_file:
+                json.dump(self.__index, index_file)
+            os.replace(temporary_path, self.__index_path)
+
+    def __current_segment(self):
+        if self.__segment is not None and self.__segment.tell() < self.SEGMENT_BYTES:
+            return self.__segment
+        if self.__segment is not None:
+            self.__segment.close()
+        segments = self.__segment_paths(self.worker_id)
+        number = int(re.search(r"(\d+)\.jsonl$", segments[-1]).group(1)) if segments else 0
+        if not segments or os.path.getsize(segments[-1]) >= self.SEGMENT_BYTES:
+            number += 1
+        path = os.path.join(self.__directory, f"turns-{self.worker_id}-{number:06d}.jsonl")
+        self.__segment = open(path, "ab", buffering=1024 * 1024)
+        return self.__segment
+
+    # every worker's segments, or only one worker's
+    def __segment_paths(self, worker_id: str | None = None) -> List[str]:
+        pattern = f"turns-{worker_id}-*.jsonl" if worker_id else "turns-*.jsonl"
+        return sorted(glob.glob(os.path.join(self.__directory, pattern)))
+
+    ##################################################
+    #################### READING #####################
+    ##################################################
+
+    def __all_events(self, query: dict | None = None, paths: List[str] | None = None, offset: int = 0):
+        if self.__collection is not None:
+            yield from self.__collection.find(query or {}, {"_id": 0}).sort("$natural", 1)
+            return
+        for position, path in enumerate(paths if paths is not None else self.__segment_paths()):
+            with open(path, "rb") as segment:
+                # the offset only applies to the first segment, where the indexed session starts
+                segment.seek(offset if position == 0 else 0)
+                for line in segment:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if query is None or event["session_id"] == query["session_id"]:
+                        yield event
+
+    def read_session(self, session_id: str) -> List[dict]:
+        """
+        Returns every event of a conversation in the order they happened.
+        A session found in this worker's index is read from where it starts instead of from the first segment.
+        :param session_id: conversation to read.
+        """
+        query = {"session_id": session_id}
+        start = next((entry for entry in self.__index.values() if entry["session_id"] == session_id), None)
+        if self.__collection is not None or start is None:
+            events = self.__all_events(query)
+        else:
+            paths = [path for path in self.__segment_paths(self.worker_id)
+                     if os.path.basename(path) >= start["segment"]]
+            events = self.__all_events(query, paths, start["offset"])
+        return sorted(events, key=lambda event: event["seq"])
+
+    def last_session_id(self, location_id: str | None = None) -> str | None:
+        """
+        Returns the conversation that wrote this worker's most recent event at a location, or None if it has none.
+        :param location_id: as given to append.
+        """
+        owner = self.__owner(location_id)
+        if self.__collection is not None:
+            last_event = self.__collection.find_one({"owner": owner}, {"session_id": 1}, sort=[("ts", -1)])
+            return last_event["session_id"] if last_event else None
+        return self.__index.get(owner, {}).get("session_id")
+
+    def transcripts(self) -> Dict[str, List[str | List[str]]]:
+        """
+        Returns the user turns of every logged conversation, in the format conversation_batch replays.
+        Merged turns come back as the list of messages they were built from.
+        """
+        sessions = defaultdict(list)
+        for event in self.__all_events():
+            if event["type"] == "user_input":
+                sessions[event["session_id"]].append(event)
+        output = {}
+        for session_id, events in sessions.items():
+            events.sort(key=lambda event: event["seq"])
+            output[session_id] = [event["data"]["text"].split("\n") if event["data"].get("merged")
+                                  else event["data"]["text"] for event in events]
+        return output
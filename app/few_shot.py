@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+
+from app import settings
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "few_shot_examples.json")
+FEATURE_DIMENSIONS = 512
+CHARS_PER_TOKEN = 4  # rough estimate, good enough to keep prompts under a budget
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def embed(texts: List[str]) -> np.ndarray:
+    """
+    Turns texts into L2-normalized hashed bag-of-features vectors (words and character trigrams).
+    crc32 is used instead of hash() so every process computes the same vectors.
+    :param texts: texts to embed.
+    :return: float32 array of shape (len(texts), FEATURE_DIMENSIONS).
+    """
+    vectors = np.zeros((len(texts), FEATURE_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = text.lower()
+        features = re.findall(r"[a-z0-9@.']+", text)
+        padded = f"  {text}  "
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        for feature in features:
+            vectors[row, zlib.crc32(feature.encode("utf-8")) % FEATURE_DIMENSIONS] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class FewShotStore:
+    """
+    Few-shot examples for each prompt, with a precomputed similarity index.
+    Instead of sending every example on every call, examples() picks the k examples most similar to the
+    user input that fit in the token budget, so adding examples doesn't make every call more expensive.
+    Examples are seeded from few_shot_examples.json. Curated production examples can be added from a file
+    in the same format (FEW_SHOT_EXAMPLES_PATH) or with add_example.
+    """
+    DEFAULT_K = 4
+    DEFAULT_TOKEN_BUDGET = 400
+
+    def __init__(self, tasks: Dict[str, dict], token_budget: int = DEFAULT_TOKEN_BUDGET):
+        """
+        :param tasks: {task: {"k": int, "examples": [[input, output], ...]}}. A task may also carry its
+                      precomputed "matrix" (e.g. memory-mapped from the shared index), then it isn't embedded again
+                      and its examples are kept as the read-only sequence they came in.
+        :param token_budget: most tokens the selected examples of one call may take.
+        """
+        self.token_budget = token_budget
+        self.__tasks = {}
+        self.replace_tasks(tasks)
+
+    @classmethod
+    def from_environment(cls) -> "FewShotStore":
+        settings.load_environment()
+        with open(EXAMPLES_PATH, encoding="utf-8") as examples_file:
+            tasks = json.load(examples_file)
+        store = cls(tasks, int(os.getenv("FEW_SHOT_TOKEN_BUDGET", cls.DEFAULT_TOKEN_BUDGET)))
+        extra_path = os.getenv("FEW_SHOT_EXAMPLES_PATH")
+        if extra_path:
+            with open(extra_path, encoding="utf-8") as extra_file:
+                for task, config in json.load(extra_file).items():
+                    store.add_examples(task, config.get("examples", []))
+        return store
+
+    def replace_tasks(self, tasks: Dict[str, dict]) -> None:
+        """
+        Swaps in a new set of tasks all at once, calls in flight keep using the old ones.
+        :param tasks: same format as the constructor's.
+        """
+        new_tasks = {}
+        for task, config in tasks.items():
+            examples = config.get("examples", [])
+            matrix = config.get("matrix")
+            if matrix is None:
+                examples = [list(example) for example in examples]
+                matrix = embed([user_input for user_input, _ in examples])
+            new_tasks[task] = {"k": config.get("k", self.DEFAULT_K), "examples": examples, "matrix": matrix}
+        self.__tasks = new_tasks
+
+    def export_tasks(self) -> Dict[str, dict]:
+        """
+        Returns every task with its examples and similarity matrix, in the constructor's format.
+        """
+        return {task: dict(config) for task, config in self.__tasks.items()}
+
+    def add_example(self, task: str, user_input: str, output: str) -> None:
+        self.add_examples(task, [[user_input, output]])
+
+    def add_examples(self, task: str, examples: List[List[str]]) -> None:
+        """
+        Adds examples to a task and rebuilds that task's similarity index.
+        :param task: call site the examples are for.
+        :param examples: list of [user input, expected output] pairs.
+        """
+        if task not in self.__tasks:
+            self.__tasks[task] = {"k": self.DEFAULT_K, "examples": [], "matrix": None}
+        task_config = self.__tasks[task]
+        # copied rather than extended, the examples may be a read-only view of the shared index
+        task_config["examples"] = [*task_config["examples"], *([user_input, output] for user_input, output in examples)]
+        task_config["matrix"] = embed([user_input for user_input, _ in task_config["examples"]])
+
+    def examples(self, task: str, user_input: str) -> List[dict]:
+        """
+        Returns chat messages for the examples most relevant to the user input.
+        :param task: call site to pick examples for.
+        :param user_input: what the user said, the examples are ranked by similarity to it.
+        :return: alternating user/assistant messages, the most similar example last.
+        """
+        task_config = self.__tasks.get(task)
+        if task_config is None or not task_config["examples"]:
+            return []
+        examples = task_config["examples"]
+        similarity = task_config["matrix"] @ embed([user_input])[0]
+        ranked = [int(index) for index in np.argsort(-similarity)]
+
+        def cost(index: int) -> int:
+            user_example, output = examples[index]
+            return estimate_tokens(user_example) + estimate_tokens(output) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+        chosen = []
+        budget = self.token_budget
+        for index in ranked:
+            if cost(index) > budget:
+                continue
+            chosen.append(index)
+            budget -= cost(index)
+            if len(chosen) == task_config["k"]:
+                break
+
+        # keep at least two different answers in the prompt so the model doesn't just copy the only one it saw,
+        # the swapped in example has to fit in what the one it replaces leaves free
+        outputs = {examples[index][1] for index in chosen}
+        if len(chosen) > 1 and len(outputs) == 1:
+            for index in ranked:
+                if examples[index][1] not in outputs and cost(index) <= budget + cost(chosen[-1]):
+                    chosen[-1] = index
+                    break
+
+        messages = []
+        for index in reversed(chosen):
+            messages.append({"role": "user", "content": examples[index][0]})
+            messages.append({"role": "assistant", "content": examples[index][1]})
+        return messages
+
+
+# one store per process, building the index for every task is only worth doing once
+@lru_cache(maxsize=None)
+def default_store() -> FewShotStore:
+    return FewShotStore.from_environment()
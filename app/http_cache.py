@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import Request, Response
+
+from app import settings
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+DEFAULT_MAX_AGE = 300  # seconds, MENU_CACHE_MAX_AGE overrides it
+
+
+class CachedJSONResponses:
+    """
+    Serves read-only JSON that only changes when its version changes (e.g. the menu).
+    Bodies are serialized and compressed once per version and kept in a small LRU, every response carries a strong
+    ETag derived from the version and the content encoding, and requests whose If-None-Match matches get a
+    bodiless 304. Endpoints run in FastAPI's threadpool, so the LRU is guarded by a lock.
+    """
+    MAX_ENTRIES = 256
+
+    def __init__(self, cache_control: str | None = None, vary: tuple = ()):
+        """
+        :param cache_control: Cache-Control header sent with every response,
+                              public for MENU_CACHE_MAX_AGE seconds by default.
+        :param vary: request headers, besides Accept-Encoding, that change the body served for the same URL.
+        """
+        if cache_control is None:
+            settings.load_environment()
+            max_age = int(os.getenv("MENU_CACHE_MAX_AGE", DEFAULT_MAX_AGE))
+            cache_control = f"public, max-age={max_age}, stale-while-revalidate={max_age}"
+        self.cache_control = cache_control
+        self.vary = ", ".join(("Accept-Encoding", *vary))
+        self.__bodies = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def respond(self, request: Request, key: str, version: str, build_payload: Callable[[], object]) -> Response:
+        """
+        :param request: incoming request, read for If-None-Match and Accept-Encoding.
+        :param key: identifies the resource, e.g. the path and query string.
+        :param version: version of the data the payload is built from.
+        :param build_payload: builds the JSON-serializable payload, only called on a cache miss.
+        """
+        encoding = self.__choose_encoding(request.headers.get("accept-encoding", ""))
+        # a strong ETag names one exact body, so the gzip, brotli and plain bodies each get their own
+        etag = f'"{version}-{hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": self.vary}
+        if self.__etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        body = self.__body(key, version, encoding, build_payload)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    # two threads missing the same key at once both build the body, which is cheaper than holding the lock for it
+    def __body(self, key: str, version: str, encoding: str, build_payload: Callable[[], object]) -> bytes:
+        cache_key = (key, version, encoding)
+        with self.__lock:
+            if cache_key in self.__bodies:
+                self.__bodies.move_to_end(cache_key)
+                return self.__bodies[cache_key]
+            identity = self.__bodies.get((key, version, "identity"))
+        if identity is None:
+            identity = json.dumps(build_payload(), separators=(",", ":")).encode("utf-8")
+            self.__store((key, version, "identity"), identity)
+        if encoding == "br":
+            body = brotli.compress(identity)
+        elif encoding == "gzip":
+            body = gzip.compress(identity)
+        else:
+            body = identity
+        self.__store(cache_key, body)
+        return body
+
+    def __store(self, cache_key: tuple, body: bytes) -> None:
+        with self.__lock:
+            self.__bodies[cache_key] = body
+            self.__bodies.move_to_end(cache_key)
+            while len(self.__bodies) > self.MAX_ENTRIES:
+                self.__bodies.popitem(last=False)
+
+    @staticmethod
+    def __etag_matches(if_none_match: str | None, etag: str) -> bool:
+        if not if_none_match:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            # If-None-Match uses the weak comparison, so W/"x" matches "x"
+            if candidate == "*" or candidate.removeprefix("W/") == etag:
+                return True
+        return False
+
+    @staticmethod
+    def __choose_encoding(accept_encoding: str) -> str:
+        accepted = {}
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted[name.lower()] = quality
+        if brotli is not None and accepted.get("br", 0) > 0:
+            return "br"
+        if accepted.get("gzip", 0) > 0:
+            return "gzip"
+        return "identity"
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, List
+
+from pymongo.errors import PyMongoError
+
+from app import tenants
+
+
+def order_payload(order: dict) -> dict:
+    """
+    Makes an order document JSON serializable for the feed, the ObjectId becomes order_id and placed_at.
+    """
+    payload = {key: value for key, value in order.items() if key != "_id"}
+    if "_id" in order:
+        payload["order_id"] = str(order["_id"])
+        payload["placed_at"] = order["_id"].generation_time.isoformat()
+    return payload
+
+
+class _Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending: int, location_id: str):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.location_id = location_id
+        # set when the subscriber fell too far behind, it gets a fresh snapshot instead of the missed events
+        self.overflowed = False
+
+    # orders from before there were locations belong to the default location
+    def wants(self, event: dict) -> bool:
+        return event["order"].get("location_id", tenants.default_location_id()) == self.location_id
+
+    def offer(self, event: dict) -> None:
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class KitchenFeed:
+    """
+    In-process pub/sub of new and updated orders for kitchen displays.
+    publish() is called from the order write path (or a ChangeStreamTailer) on any thread, and every
+    subscriber gets the event pushed to its own queue on its event loop, so displays don't poll MongoDB.
+    Recent events are kept in a ring buffer. Each event id is a resume token: a display that reconnects with
+    the last id it saw gets only what it missed. When the id is from another process or older than the buffer,
+    the display gets a snapshot of the recent orders instead.
+    There is one feed for every location, each subscriber only gets the events of the location it asked for.
+    """
+    HISTORY_SIZE = 1000
+    MAX_PENDING = 1000  # events queued for one subscriber before it is resynced with a snapshot
+    HEARTBEAT_SECONDS = 15.0
+
+    def __init__(self, snapshot_source: Callable[[str], List[dict]] | None = None,
+                 history_size: int = HISTORY_SIZE):
+        """
+        :param snapshot_source: takes a location id and returns its recent order documents,
+                                sent to new and stale subscribers.
+        :param history_size: number of events kept for resuming.
+        """
+        self.__snapshot_source = snapshot_source
+        # tokens from before a restart can't be resumed, the epoch tells them apart
+        self.__epoch = uuid.uuid4().hex[:8]
+        self.__seq = 0
+        self.__history = deque(maxlen=history_size)
+        self.__subscriptions = set()
+        self.__lock = threading.Lock()
+
+    def publish(self, event_type: str, order: dict) -> dict:
+        """
+        Sends an order event to every subscriber. Safe to call from any thread.
+        :param event_type: "inserted" or "updated".
+        :param order: the order document as stored.
+        :return: the event that was sent.
+        """
+        with self.__lock:
+            self.__seq += 1
+            event = {"id": f"{self.__epoch}:{self.__seq}", "type": event_type, "ts": time.time(),
+                     "order": order_payload(order)}
+            self.__history.append((self.__seq, event))
+            subscriptions = list(self.__subscriptions)
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.offer, event)
+        return event
+
+    def subscriber_count(self) -> int:
+        with self.__lock:
+            return len(self.__subscriptions)
+
+    async def subscribe(self, location_id: str, resume_token: str | None = None,
+                        heartbeat_seconds: float = HEARTBEAT_SECONDS) -> AsyncIterator[dict | None]:
+        """
+        Yields the location's events after resume_token, then its live events as they are published.
+        Yields None after heartbeat_seconds without events so the caller can keep the connection alive.
+        :param location_id: location whose orders to follow.
+        :param resume_token: id of the last event the subscriber saw, if any.
+        :param heartbeat_seconds: idle time before a None is yielded.
+        """
+        subscription = _Subscription(asyncio.get_running_loop(), self.MAX_PENDING, location_id)
+        # registering and reading the backlog under the same lock means no event falls between the two
+        with self.__lock:
+            self.__subscriptions.add(subscription)
+            backlog = self.__events_after(resume_token)
+            snapshot_id = f"{self.__epoch}:{self.__seq}"
+        try:
+            if backlog is None:
+                yield await self.__snapshot(snapshot_id, location_id)
+            else:
+                for event in backlog:
+                    if subscription.wants(event):
+                        yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    subscription.overflowed = False
+                    with self.__lock:
+                        snapshot_id = f"{self.__epoch}:{self.__seq}"
+                    yield await self.__snapshot(snapshot_id, location_id)
+                    continue
+                yield event
+        finally:
+            with self.__lock:
+                self.__subscriptions.discard(subscription)
+
+    # None when the token can't be resumed from the buffer
+    def __events_after(self, resume_token: str | None) -> List[dict] | None:
+        if not resume_token:
+            return None
+        epoch, _, seq = resume_token.partition(":")
+        if epoch != self.__epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self.__history[0][0] if self.__history else self.__seq + 1
+        if seq > self.__seq or seq < oldest - 1:
+            return None
+        return [event for event_seq, event in self.__history if event_seq > seq]
+
+    # orders written while the snapshot is read can show up in it and as an event, displays key on order_id
+    async def __snapshot(self, snapshot_id: str, location_id: str) -> dict:
+        orders = []
+        if self.__snapshot_source is not None:
+            orders = await asyncio.to_thread(self.__snapshot_source, location_id)
+        return {"id": snapshot_id, "type": "snapshot", "ts": time.time(), "location_id": location_id,
+                "orders": [order_payload(order) for order in orders]}
+
+
+class ChangeStreamTailer:
+    """
+    Feeds a KitchenFeed from a MongoDB change stream on the orders collection, so orders written by other
+    processes reach the displays too. Change streams need a replica set or Atlas.
+    The stream's own resume token is kept so a dropped connection picks up where it left off.
+    """
+    RETRY_SECONDS = 2.0
+
+    def __init__(self, collection, feed: KitchenFeed):
+        """
+        :param collection: pymongo collection to watch.
+        :param feed: where the changes are published.
+        """
+        self.__collection = collection
+        self.__feed = feed
+        self.__resume_after = None
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__tail, name="kitchen-change-stream", daemon=True)
+
+    def start(self) -> "ChangeStreamTailer":
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.__stop.set()
+        self.__thread.join()
+
+    def __tail(self) -> None:
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]},
+                                "fullDocument.name": {"$ne": "EXAMPLE_ORDER"}}}]
+        while not self.__stop.is_set():
+            try:
+                with self.__collection.watch(pipeline, full_document="updateLookup",
+                                             resume_after=self.__resume_after, max_await_time_ms=1000) as stream:
+                    while not self.__stop.is_set():
+                        # try_next returns None after the server's await time so the stop flag gets checked
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        self.__resume_after = stream.resume_token
+                        if change.get("fullDocument") is None:
+                            continue  # updated and then deleted before the lookup
+                        event_type = "inserted" if change["operationType"] == "insert" else "updated"
+                        self.__feed.publish(event_type, change["fullDocument"])
+            except PyMongoError as error:
+                print(f"Kitchen change stream failed, retrying: \n{error}")
+                self.__stop.wait(self.RETRY_SECONDS)
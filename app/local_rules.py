@@ -0,0 +1,121 @@
+import re
+from typing import Callable, Dict, List
+
+# Rule-based stand-ins for the small classification and extraction prompts.
+# Each rule takes the user's message and returns text in the same format the model is asked to produce,
+# so the assistant can't tell which backend answered.
+
+_PHONE_PATTERN = re.compile(r"\(?(\d{3})\)?[\s.-]?(\d{3})[\s.-]?(\d{4})")
+_EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# "my name is" can only be followed by a name, after "i'm" it has to look like one ("I'm ordering for pickup")
+_NAME_PATTERNS = [
+    re.compile(r"(?i:my name is|name is|under the name)\s+([A-Za-z][A-Za-z'-]*(?:\s+[A-Z][A-Za-z'-]*)?)"),
+    re.compile(r"\b(?i:i am|i'm)\s+([A-Z][A-Za-z'-]*(?:\s+[A-Z][A-Za-z'-]*)?)"),
+]
+_YES_WORDS = {"yes", "yeah", "yep", "yup", "correct", "right", "sure", "submit", "confirm", "perfect", "ok", "okay",
+              "good", "great", "fine", "absolutely", "definitely"}
+# words that can go with a yes without changing it, anything else ("but", "swap", ...) may be a change request
+_AFFIRMATIVE_FILLER = {"please", "it", "that", "that's", "thats", "is", "looks", "sounds", "all", "go", "ahead",
+                       "do", "thanks", "thank", "you", "the", "order", "my", "it's", "its", "nothing", "else", "and",
+                       "place", "just", "very", "much", "everything", "this"}
+_MENU_WORDS = {"menu", "beer", "beers", "have", "serve", "options", "drinks", "food", "offer", "selection"}
+_QUESTION_WORDS = {"open", "close", "closed", "hours", "where", "located", "location", "parking", "reservation",
+                   "reservations", "wifi", "dog", "dogs", "kids", "events", "address"}
+_NOT_NAMES = {"looking", "done", "ready", "hungry", "not", "going", "paying", "here", "just", "good", "fine"}
+_NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+                 "eight": 8, "nine": 9, "ten": 10, "couple": 2}
+_QUANTITY_PATTERN = re.compile(r"(\d+|" + "|".join(_NUMBER_WORDS) + r")\s+(?:(?:orders?|pints?|plates?|of|the)\s+)*$")
+
+
+def _words(user_prompt: str) -> set:
+    return set(re.findall(r"[a-z']+", user_prompt.lower()))
+
+
+# a degraded "yes" submits the order, so anything but a plain confirmation counts as "no"
+def order_verification(user_prompt: str) -> str:
+    words = _words(user_prompt)
+    if not words & _YES_WORDS or not words <= _YES_WORDS | _AFFIRMATIVE_FILLER or user_prompt.strip().endswith("..."):
+        return "no"
+    return "yes"
+
+
+def user_phone_extractor(user_prompt: str) -> str:
+    match = _PHONE_PATTERN.search(user_prompt)
+    if match is None:
+        return "000-000-0000"
+    return "-".join(match.groups())
+
+
+def user_email_extractor(user_prompt: str) -> str:
+    match = _EMAIL_PATTERN.search(user_prompt)
+    return match.group(0) if match else "None"
+
+
+def user_name_extractor(user_prompt: str) -> str:
+    for pattern in _NAME_PATTERNS:
+        match = pattern.search(user_prompt)
+        if match is not None and match.group(1).split()[0].lower() not in _NOT_NAMES:
+            return match.group(1).title()
+    return "None"
+
+
+def payment_method_extractor(user_prompt: str) -> str:
+    words = _words(user_prompt)
+    cash = "cash" in words
+    card = bool(words & {"card", "credit", "debit", "visa", "mastercard", "amex"})
+    if cash and card:
+        return "Both"
+    if cash:
+        return "Cash"
+    if card:
+        return "Card"
+    return "None"
+
+
+def intent(user_prompt: str) -> str:
+    words = _words(user_prompt)
+    if user_phone_extractor(user_prompt) != "000-000-0000" or user_email_extractor(user_prompt) != "None":
+        return "order food"
+    if words & _QUESTION_WORDS:
+        return "question answer"
+    if words & _MENU_WORDS and ("?" in user_prompt or "menu" in words):
+        return "get menu"
+    return "order food"
+
+
+def order_items(user_prompt: str, item_names: List[str]) -> dict | None:
+    """
+    Picks up menu items named as they are on the menu, with the quantity in front of them ("two Hazy IPAs").
+    Not a call site rule, the output is the parsed order_items_extractor format.
+    :param user_prompt: what the user said.
+    :param item_names: every item name on the menu.
+    :return: {item: {"item_qty": n}}, or None if no item was named.
+    """
+    text = user_prompt.lower()
+    output = {}
+    # longest names first so "Loaded Nachos" wins over "Nachos"
+    for name in sorted(item_names, key=len, reverse=True):
+        match = re.search(r"\b" + re.escape(name.lower()) + r"(?:e?s)?\b", text)
+        if match is None:
+            continue
+        quantity = _QUANTITY_PATTERN.search(text[:match.start()])
+        if quantity is None:
+            item_qty = 1
+        elif quantity.group(1).isdigit():
+            item_qty = int(quantity.group(1))
+        else:
+            item_qty = _NUMBER_WORDS[quantity.group(1)]
+        output[name] = {"item_qty": item_qty}
+        text = text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+    return output or None
+
+
+# call site name -> rule, only the call sites a rule can stand in for are listed
+RULES: Dict[str, Callable[[str], str]] = {
+    "order_verification": order_verification,
+    "user_phone_extractor": user_phone_extractor,
+    "user_email_extractor": user_email_extractor,
+    "user_name_extractor": user_name_extractor,
+    "payment_method_extractor": payment_method_extractor,
+    "intent": intent,
+}
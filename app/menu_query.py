@@ -0,0 +1,198 @@
+import operator
+import re
+from typing import Dict, List, Set
+
+# words that carry no meaning about *which* item the user is asking for
+_STOP_WORDS = {
+    "a", "an", "the", "do", "does", "you", "your", "guys", "y'all", "yall", "have", "has", "got", "is", "are", "there",
+    "any", "anything", "some", "on", "in", "at", "of", "for", "to", "with", "and", "or", "menu", "what", "which",
+    "whats", "what's", "kind", "kinds", "type", "types", "sort", "sorts", "serve", "sell", "offer", "carry", "can", "i",
+    "we", "me", "get", "see", "list", "show", "tell", "about", "how", "much", "cost", "costs", "price", "prices",
+    "priced", "it", "that", "this", "these", "those", "please", "right", "now", "today", "under", "below", "over",
+    "above", "less", "more", "than", "cheaper", "pricier", "stronger", "weaker", "at", "least", "most", "max",
+    "dollars", "dollar", "bucks", "abv", "percent", "alcohol", "cheapest", "expensive", "strongest", "lightest",
+    "weakest", "hey", "hi", "all", "options", "available", "here", "be", "would", "like", "want", "there's", "theres",
+    "item", "items", "thing", "things", "else", "other", "also", "too", "just", "only", "currently", "yours",
+    "take", "look", "full", "entire", "whole", "again", "pint", "glass", "plate", "order", "one", "side",
+}
+# questions that need an opinion or outside knowledge are left to the model
+_OPEN_ENDED_WORDS = {"recommend", "recommendation", "suggest", "suggestion", "best", "good", "favorite",
+                     "favourite", "popular", "pair", "pairs", "pairing", "goes", "taste", "tastes", "similar",
+                     "healthy", "vegan", "vegetarian", "gluten", "allergy", "allergies", "spicy", "why", "difference"}
+_OPEN_ENDED_PHRASES = re.compile(r"\b(what('s| is| are) in|made (with|of|from)|come with|ingredient)")
+_SECTION_WORDS = {"beer": "beer", "brew": "beer", "drink": "beer", "food": "food", "eat": "food", "dish": "food"}
+_PRICE_QUESTION = re.compile(r"\b(how much|price|cost|costs|priced)\b")
+_EXISTENCE_QUESTION = re.compile(r"\b(do (you|y'all|yall|u)( guys)? (have|serve|sell|carry|offer)|is there|are there|"
+                                 r"got any|you got|have you got|on the menu|any)\b")
+_LISTING_QUESTION = re.compile(r"\b(what|which|list|show|tell me|see|look|menu)\b")
+_COMPARISON = re.compile(r"\b(under|below|less than|cheaper than|at most|over|above|more than|pricier than|at least|"
+                         r"stronger than|weaker than)\s*\$?(\d+(?:\.\d+)?)\s*(%|percent|abv)?")
+# "under $7" leaves out what costs exactly $7, "at most $7" keeps it
+_BOUNDS = {"under": operator.lt, "below": operator.lt, "less than": operator.lt, "cheaper than": operator.lt,
+           "weaker than": operator.lt, "at most": operator.le, "over": operator.gt, "above": operator.gt,
+           "more than": operator.gt, "pricier than": operator.gt, "stronger than": operator.gt,
+           "at least": operator.ge}
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _tokens(text: str) -> List[str]:
+    return [_stem(word) for word in re.findall(r"[a-z0-9']+", text.lower())]
+
+
+class MenuQueryEngine:
+    """
+    Answers questions about the menu ("Is there a steak on the menu?", "What beers under $7 do you have?",
+    "How much are the loaded nachos?") from the menu snapshot, without a model call.
+    Items are looked up in two inverted indexes, one over names, types and categories and one that also covers
+    descriptions, then narrowed with price and ABV filters. Terms of several words only match a description that
+    has them side by side, so "grilled cheese" doesn't find a grilled patty with Swiss cheese.
+    answer() returns None when the question is open-ended, so the caller can fall back to the model.
+    """
+
+    def __init__(self, menu):
+        """
+        :param menu: MenuSnapshot to index.
+        """
+        self.menu = menu
+        self.items = menu.items()
+        self.__name_index: Dict[str, Set[int]] = {}
+        self.__text_index: Dict[str, Set[int]] = {}
+        self.__descriptions: List[List[str]] = []
+        self.__categories = {_stem(category.lower()): category for category in menu.food_menu}
+        for position, item in enumerate(self.items):
+            name_tokens = _tokens(f"{item['name']} {item['category']} {item.get('type', '')}")
+            self.__descriptions.append(_tokens(item.get("description", "")))
+            for token in name_tokens:
+                self.__name_index.setdefault(token, set()).add(position)
+            for token in name_tokens + self.__descriptions[-1]:
+                self.__text_index.setdefault(token, set()).add(position)
+
+    def search(self, query: str) -> List[dict]:
+        """
+        Returns the items matching every word of the query, in names, types, categories or descriptions,
+        narrowed by any price or ABV limits in the query.
+        :param query: free text.
+        """
+        terms, _, section, filters = self.__parse(query.lower())
+        return [self.items[position] for position in self.__lookup(terms, section, filters, self.__text_index)]
+
+    def answer(self, question: str) -> str | None:
+        """
+        Answers existence, listing and price questions about the menu.
+        :param question: what the user asked.
+        :return: the answer, or None if the question needs the model.
+        """
+        text = question.lower()
+        words = set(re.findall(r"[a-z']+", text))
+        if words & _OPEN_ENDED_WORDS or _OPEN_ENDED_PHRASES.search(text):
+            return None
+        terms, words, section, filters = self.__parse(text)
+        asks_price = _PRICE_QUESTION.search(text) is not None
+        asks_existence = _EXISTENCE_QUESTION.search(text) is not None
+        asks_listing = _LISTING_QUESTION.search(text) is not None
+        if not (asks_price or asks_existence or asks_listing or filters):
+            return None
+        if not terms and section is None and not filters:
+            return self.menu.text
+
+        matches = self.__lookup(terms, section, filters, self.__name_index)
+        description_matches = []
+        if not matches and terms:
+            description_matches = [position for position in self.__lookup(terms, section, filters, self.__text_index)
+                                   if self.__has_phrase(position, terms)]
+        if not matches and not description_matches and terms and asks_listing and not asks_existence:
+            # "what goes in the ..." style questions with words we don't know
+            return None
+
+        items = [self.items[position] for position in matches]
+        phrase = " ".join(words)
+        if asks_price and items:
+            return "\n".join(f"The {item['name']} is ${item['price']:.2f}." for item in items)
+        if items:
+            intro = "Yes! We have:" if asks_existence and terms and not asks_listing else "Here's what we have:"
+            return "\n".join([intro] + [self.__describe(item) for item in items])
+        if description_matches:
+            return "\n".join([f"We don't have {phrase} on the menu, but these items come with it:"]
+                             + [self.__describe(self.items[position]) for position in description_matches])
+        if terms:
+            return f"Sorry, we don't have {phrase} on the menu."
+        return "Sorry, nothing on the menu matches that."
+
+    ##################################################
+    #################### HELPERS #####################
+    ##################################################
+
+    # the stemmed terms to look up, the words they came from, the section asked about and the filters
+    def __parse(self, text: str) -> tuple[List[str], List[str], str | None, List[tuple]]:
+        filters = []
+        for match in _COMPARISON.finditer(text):
+            comparator, number, unit = match.groups()
+            attribute = "abv" if unit or "stronger" in comparator or "weaker" in comparator else "price"
+            filters.append((attribute, _BOUNDS[comparator], float(number)))
+        for superlative, attribute, direction in (("cheapest", "price", "lowest"),
+                                                  ("most expensive", "price", "highest"),
+                                                  ("strongest", "abv", "highest"),
+                                                  ("lightest", "abv", "lowest"),
+                                                  ("weakest", "abv", "lowest")):
+            if superlative in text:
+                filters.append((attribute, direction, None))
+
+        section = None
+        terms = []
+        words = []
+        for word in re.findall(r"[a-z0-9']+", _COMPARISON.sub(" ", text)):
+            stem = _stem(word)
+            if word in _STOP_WORDS or stem in _STOP_WORDS or word.isdigit():
+                continue
+            if stem in _SECTION_WORDS:
+                section = _SECTION_WORDS[stem]
+                continue
+            terms.append(stem)
+            words.append(word)
+        return terms, words, section, filters
+
+    def __lookup(self, terms: List[str], section: str | None, filters: List[tuple],
+                 index: Dict[str, Set[int]]) -> List[int]:
+        positions = set(range(len(self.items)))
+        for term in terms:
+            matching = set(index.get(term, set()))
+            # "burger" should find the hamburgers category
+            for category_stem, category in self.__categories.items():
+                if category_stem.endswith(term):
+                    matching.update(position for position, item in enumerate(self.items)
+                                    if item["category"] == category)
+            positions &= matching
+        if section is not None:
+            positions = {position for position in positions if self.items[position]["section"] == section}
+
+        for attribute, bound, value in filters:
+            positions = {position for position in positions if attribute in self.items[position]}
+            if callable(bound):
+                positions = {position for position in positions if bound(self.items[position][attribute], value)}
+            elif positions:
+                pick = min if bound == "lowest" else max
+                best = pick(self.items[position][attribute] for position in positions)
+                positions = {position for position in positions if self.items[position][attribute] == best}
+        return sorted(positions)
+
+    # the terms in a row in the item's description, or a single term anywhere in its text
+    def __has_phrase(self, position: int, terms: List[str]) -> bool:
+        if len(terms) == 1:
+            return True
+        description = self.__descriptions[position]
+        return any(description[start:start + len(terms)] == terms for start in range(len(description)))
+
+    @staticmethod
+    def __describe(item: dict) -> str:
+        if item["section"] == "beer":
+            return f"- {item['name']} ({item.get('type', 'Beer')}, {item.get('abv', 0)}% ABV) - ${item['price']:.2f}"
+        return f"- {item['name']} - ${item['price']:.2f}"
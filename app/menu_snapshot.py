@@ -0,0 +1,98 @@
+import hashlib
+import json
+from functools import cached_property
+from typing import List
+
+from app import menu_query
+
+
+class MenuSnapshot:
+    """
+    Immutable in-memory copy of the menu document.
+    Holds the parsed beer and food menus, a version hash that changes whenever the menu changes,
+    and the menu rendered as text for the welcome message and for "show me the menu" questions.
+    """
+
+    def __init__(self, menu_documents: List[dict]):
+        self.beer_menu = {}
+        self.food_menu = {}
+        for section in menu_documents:
+            self.beer_menu = section.get("beer_menu", {})
+            self.food_menu = section.get("food_menu", {})
+        canonical = json.dumps({"beer_menu": self.beer_menu, "food_menu": self.food_menu},
+                               sort_keys=True, separators=(",", ":"))
+        self.version = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+        self.text = self.__render()
+        self.rendered = ("Hello, welcome to the brewpub! Here is our menu:\n\n"
+                         f"{self.text}\n\n"
+                         "What would you like to order?")
+
+    @classmethod
+    def from_json(cls, menu_json: str) -> "MenuSnapshot":
+        """
+        Builds a snapshot from the output of DBHandler.get_menu.
+        :param menu_json: JSON array of menu documents.
+        """
+        return cls(json.loads(menu_json))
+
+    def item_price(self, item: str) -> float | None:
+        """
+        Returns the price of a menu item, or None if the item is not on the menu.
+        :param item: exact name of the item as it appears on the menu.
+        """
+        if item in self.beer_menu:
+            return self.beer_menu[item]["price"]
+        for category in self.food_menu.values():
+            if item in category:
+                return category[item]["price"]
+        return None
+
+    # only built the first time someone asks a menu question
+    @cached_property
+    def query_engine(self) -> menu_query.MenuQueryEngine:
+        return menu_query.MenuQueryEngine(self)
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, "beer_menu": self.beer_menu, "food_menu": self.food_menu}
+
+    def section(self, name: str) -> dict | None:
+        """
+        Returns one part of the menu: "beer", "food" or a food category such as "appetizers".
+        :param name: section name, case-insensitive. The "_menu" suffix is optional.
+        :return: the section's items, or None if there is no such section.
+        """
+        name = name.lower().removesuffix("_menu")
+        if name == "beer":
+            return self.beer_menu
+        if name == "food":
+            return self.food_menu
+        for category, items in self.food_menu.items():
+            if category.lower() == name:
+                return items
+        return None
+
+    def items(self) -> List[dict]:
+        """
+        Returns every item on the menu as a flat list, each with its name, section and category.
+        """
+        output = [{"name": name, "section": "beer", "category": beer.get("type", ""), **beer}
+                  for name, beer in self.beer_menu.items()]
+        for category, items in self.food_menu.items():
+            output.extend({"name": name, "section": "food", "category": category, **food}
+                          for name, food in items.items())
+        return output
+
+    def __render(self) -> str:
+        lines = ["BEER MENU"]
+        for name, beer in self.beer_menu.items():
+            lines.append(f"- {name} ({beer.get('type', 'Beer')}, {beer.get('abv', 0)}% ABV) - ${beer['price']:.2f}")
+            if beer.get("description"):
+                lines.append(f"    {beer['description']}")
+        lines.extend(["", "FOOD MENU"])
+        for category, items in self.food_menu.items():
+            lines.append(category.title())
+            for name, food in items.items():
+                lines.append(f"- {name} - ${food['price']:.2f}")
+                if food.get("description"):
+                    lines.append(f"    {food['description']}")
+        return "\n".join(lines)
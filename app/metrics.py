@@ -0,0 +1,23 @@
+import threading
+from collections import defaultdict
+
+
+class Counters:
+    """
+    Thread-safe named counters, read by the /metrics endpoints.
+    """
+
+    def __init__(self):
+        self.__values = defaultdict(float)
+        self.__lock = threading.Lock()
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        with self.__lock:
+            self.__values[name] += amount
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return dict(self.__values)
+
+
+turn_metrics = Counters()
@@ -0,0 +1,233 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List
+
+import openai
+
+from app import deadline
+from app import local_rules
+from app import settings
+
+DEFAULT_MODEL = 'gpt-3.5-turbo-0613'
+BACKENDS = ("openai", "local")
+
+# every place the assistant talks to a model, routed to DEFAULT_MODEL on OpenAI unless configured otherwise
+CALL_SITES = [
+    "order_verification",
+    "order_items_extractor",
+    "order_items_cross_check",
+    "user_name_extractor",
+    "user_phone_extractor",
+    "user_email_extractor",
+    "payment_method_extractor",
+    "intent",
+    "nice_response",
+    "faq_classification",
+    "faq_answer",
+    "menu_answer",
+    "summarizer",
+]
+
+# USD per 1K tokens as (prompt, completion), used to compare the cost of a shadow model with the current one
+MODEL_PRICES = {
+    "gpt-3.5-turbo-0613": (0.0015, 0.002),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "local": (0.0, 0.0),
+}
+
+
+class ModelRouter:
+    """
+    Sends each call site to its configured backend and model.
+    Routes are read from the MODEL_ROUTES environment variable, either inline JSON or a path to a JSON file:
+        {"routes": {"intent": {"backend": "local"}, "faq_answer": {"model": "gpt-4", "max_tokens": 300}},
+         "shadow": {"intent": {"backend": "openai", "model": "gpt-3.5-turbo", "sample_rate": 0.1}}}
+    A shadow route runs a candidate model on a sample of the traffic, after the real answer has been returned,
+    and records its latency, cost and how often it agrees with the current model.
+    The local backend only exists for the call sites with a rule in local_rules.RULES.
+    """
+    SHADOW_WORKERS = 4
+    DEFAULT_ESTIMATED_SECONDS = 1.5  # used for a call site until it has been timed
+
+    def __init__(self, routes: dict | None = None, shadow: dict | None = None):
+        """
+        :param routes: {call site: route} overriding the default route.
+        :param shadow: {call site: route} to run on a sample of the traffic.
+        :raises ValueError: if a route names an unknown backend, or the local backend for a call site without a rule.
+        """
+        for call_site, route in [*(routes or {}).items(), *(shadow or {}).items()]:
+            self.__validate(call_site, route)
+        self.routes = {call_site: {"backend": "openai", "model": DEFAULT_MODEL} for call_site in CALL_SITES}
+        for call_site, route in (routes or {}).items():
+            self.routes[call_site] = {**self.routes.get(call_site, {"backend": "openai", "model": DEFAULT_MODEL}),
+                                      **route}
+        self.shadow = shadow or {}
+        self.__stats = defaultdict(lambda: defaultdict(float))
+        self.__stats_lock = threading.Lock()
+        self.__shadow_executor = ThreadPoolExecutor(max_workers=self.SHADOW_WORKERS) if self.shadow else None
+
+    @classmethod
+    def from_environment(cls) -> "ModelRouter":
+        settings.load_environment()
+        config = os.getenv("MODEL_ROUTES", "").strip()
+        if not config:
+            return cls()
+        if not config.startswith("{"):
+            with open(config, encoding="utf-8") as config_file:
+                config = config_file.read()
+        config = json.loads(config)
+        return cls(config.get("routes"), config.get("shadow"))
+
+    def complete(self, call_site: str, messages: List[dict], turn_deadline: deadline.Deadline | None = None,
+                 fallback: Callable[[str], str] | None = None, **params) -> str:
+        """
+        Runs a chat completion for a call site on its configured backend.
+        When the turn doesn't have enough time left for the call, or the call times out, the call site's
+        rule-based stand-in or the given fallback answers instead. Without either, DeadlineExceeded is raised.
+        :param call_site: one of CALL_SITES.
+        :param messages: chat messages, the last one is the user input.
+        :param turn_deadline: time budget of the current turn, if any.
+        :param fallback: deterministic answer for this call, takes the user input and returns the reply text.
+        :param params: completion parameters (temperature, max_tokens, ...), the route can override them.
+        :return: the content of the model's reply.
+        """
+        route = self.routes.get(call_site, {"backend": "openai", "model": DEFAULT_MODEL})
+        if turn_deadline is not None:
+            if not self.can_afford(call_site, turn_deadline):
+                return self.__degrade(call_site, messages, turn_deadline, fallback)
+            if route.get("backend") != "local":
+                params["request_timeout"] = turn_deadline.remaining()
+        try:
+            content, latency, cost = self.__run(call_site, route, messages, params)
+        except openai.error.Timeout:
+            if turn_deadline is None:
+                raise
+            return self.__degrade(call_site, messages, turn_deadline, fallback)
+        self.__record(call_site, "current", latency, cost)
+
+        shadow_route = self.shadow.get(call_site)
+        if shadow_route is not None and random.random() < shadow_route.get("sample_rate", 0.1):
+            # the shadow call runs after the turn, the turn's timeout doesn't apply to it
+            shadow_params = {key: value for key, value in params.items() if key != "request_timeout"}
+            self.__shadow_executor.submit(self.__run_shadow, call_site, shadow_route, messages, shadow_params, content)
+        return content
+
+    def estimated_seconds(self, call_site: str) -> float:
+        """
+        Returns the average latency of the call site's current route so far.
+        """
+        with self.__stats_lock:
+            stats = self.__stats.get(call_site)
+            if not stats or not stats["current_calls"]:
+                return self.DEFAULT_ESTIMATED_SECONDS
+            return stats["current_latency"] / stats["current_calls"]
+
+    def can_afford(self, call_site: str, turn_deadline: deadline.Deadline | None) -> bool:
+        """
+        :return: True if the call site usually finishes inside the turn's remaining budget.
+        """
+        if turn_deadline is None or self.routes.get(call_site, {}).get("backend") == "local":
+            return True
+        return turn_deadline.has(self.estimated_seconds(call_site))
+
+    def report(self) -> dict:
+        """
+        Returns per call site averages for the current route and, when shadowed, the candidate route.
+        """
+        with self.__stats_lock:
+            output = {}
+            for call_site, stats in self.__stats.items():
+                output[call_site] = {"route": self.routes.get(call_site)}
+                for variant in ("current", "shadow"):
+                    calls = stats[f"{variant}_calls"]
+                    if not calls:
+                        continue
+                    output[call_site][variant] = {
+                        "calls": int(calls),
+                        "avg_latency_ms": round(stats[f"{variant}_latency"] / calls * 1000, 2),
+                        "avg_cost_usd": round(stats[f"{variant}_cost"] / calls, 6),
+                    }
+                if stats["shadow_calls"]:
+                    output[call_site]["shadow"]["route"] = self.shadow.get(call_site)
+                    agreement_rate = stats["agreements"] / stats["shadow_calls"]
+                    output[call_site]["shadow"]["agreement_rate"] = round(agreement_rate, 4)
+            return output
+
+    ##################################################
+    #################### BACKENDS ####################
+    ##################################################
+
+    # without this a bad route would silently go to OpenAI on the default model, and a "local" one without
+    # the deadline checks
+    @staticmethod
+    def __validate(call_site: str, route: dict) -> None:
+        backend = route.get("backend", "openai")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r} for {call_site}, expected one of {', '.join(BACKENDS)}.")
+        if backend == "local" and call_site not in local_rules.RULES:
+            raise ValueError(f"{call_site} has no local rule, it can't use the local backend. "
+                             f"Call sites with one: {', '.join(local_rules.RULES)}.")
+
+    def __run(self, call_site: str, route: dict, messages: List[dict], params: dict) -> tuple[str, float, float]:
+        params = {**params, **{key: value for key, value in route.items()
+                               if key not in ("backend", "model", "sample_rate")}}
+        start = time.perf_counter()
+        if route.get("backend") == "local":
+            content = local_rules.RULES[call_site](messages[-1]["content"])
+            return content, time.perf_counter() - start, 0.0
+
+        model = route.get("model", DEFAULT_MODEL)
+        response = openai.ChatCompletion.create(model=model, messages=messages, **params)
+        latency = time.perf_counter() - start
+        prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        usage = response.get("usage", {})
+        cost = (usage.get("prompt_tokens", 0) * prompt_price
+                + usage.get("completion_tokens", 0) * completion_price) / 1000
+        return response['choices'][0]['message']['content'], latency, cost
+
+    def __degrade(self, call_site: str, messages: List[dict], turn_deadline: deadline.Deadline,
+                  fallback: Callable[[str], str] | None) -> str:
+        turn_deadline.degrade(call_site)
+        if call_site in local_rules.RULES:
+            return local_rules.RULES[call_site](messages[-1]["content"])
+        if fallback is not None:
+            return fallback(messages[-1]["content"])
+        raise deadline.DeadlineExceeded(f"No time left in the turn for {call_site}.")
+
+    def __run_shadow(self, call_site: str, route: dict, messages: List[dict], params: dict, current: str) -> None:
+        try:
+            content, latency, cost = self.__run(call_site, route, messages, params)
+        except Exception as error:
+            print(f"Shadow call for {call_site} failed: \n{error}")
+            return
+        self.__record(call_site, "shadow", latency, cost)
+        if content.strip().lower() == current.strip().lower():
+            with self.__stats_lock:
+                self.__stats[call_site]["agreements"] += 1
+
+    def __record(self, call_site: str, variant: str, latency: float, cost: float) -> None:
+        with self.__stats_lock:
+            stats = self.__stats[call_site]
+            stats[f"{variant}_calls"] += 1
+            stats[f"{variant}_latency"] += latency
+            stats[f"{variant}_cost"] += cost
+
+
+# one router per process so every assistant shares the same routes and statistics
+@lru_cache(maxsize=None)
+def default_router() -> ModelRouter:
+    return ModelRouter.from_environment()
+
+
+# replays get their own statistics, so they don't skew /metrics/models or the latency estimates live turns rely on
+@lru_cache(maxsize=None)
+def replay_router() -> ModelRouter:
+    return ModelRouter.from_environment()
@@ -0,0 +1,179 @@
+from datetime import datetime
+from typing import List
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from app import tenants
+
+
+class SalesReports:
+    """
+    Sales analytics over the orders collection.
+    Reads come from small pre-aggregated rollup documents that are updated every time an order is inserted,
+    so dashboards never have to scan the full order history. The rollups can be rebuilt from scratch with
+    server-side aggregation pipelines if they ever drift.
+    Every location has its own rollups in the shared collection, their ids are prefixed with the location id.
+    """
+    ROLLUP_COLLECTION = "sales_rollups"
+    # the example order is only there to show ChatGPT the order format, it is not a sale
+    __ORDER_FILTER = {"name": {"$ne": "EXAMPLE_ORDER"}}
+
+    def __init__(self, db, location_id: str):
+        """
+        :param db: pymongo database.
+        :param location_id: location whose orders are reported on.
+        """
+        self.db = db
+        self.location_id = location_id
+        self.rollups = self.db.get_collection(self.ROLLUP_COLLECTION)
+        self.__prefix = f"{location_id}:"
+        self.__order_filter = {"$and": [self.__ORDER_FILTER, tenants.location_filter(location_id)]}
+
+    def ensure_indexes(self) -> None:
+        """
+        Creates the indexes the dashboard reads rely on.
+        """
+        self.rollups.create_index([("location_id", ASCENDING), ("kind", ASCENDING), ("qty", DESCENDING)])
+        self.rollups.create_index([("location_id", ASCENDING), ("kind", ASCENDING), ("hour", ASCENDING)])
+
+    ##################################################
+    ############### INCREMENTAL ROLLUPS ##############
+    ##################################################
+
+    def record_order(self, order: dict, order_time: datetime) -> None:
+        """
+        Folds a newly inserted order into the rollup documents.
+        :param order: the order document that was inserted.
+        :param order_time: when the order was placed, used for the hourly bucket.
+        """
+        if order.get("name") == "EXAMPLE_ORDER":
+            return
+        order_total = order.get("order_total") or 0.0
+        hour_start = order_time.replace(minute=0, second=0, microsecond=0)
+        updates = [
+            UpdateOne({"_id": f"{self.__prefix}totals"},
+                      {"$inc": {"order_count": 1, "revenue": order_total},
+                       "$setOnInsert": {"kind": "totals", "location_id": self.location_id}},
+                      upsert=True),
+            UpdateOne({"_id": f"{self.__prefix}hour:{hour_start:%Y-%m-%dT%H}"},
+                      {"$inc": {"order_count": 1, "revenue": order_total},
+                       "$setOnInsert": {"kind": "hour", "hour": hour_start, "location_id": self.location_id}},
+                      upsert=True)
+        ]
+        for item, details in (order.get("order_items") or {}).items():
+            if details is None:
+                continue
+            updates.append(
+                UpdateOne({"_id": f"{self.__prefix}item:{item}"},
+                          {"$inc": {"qty": details.get("item_qty", 0),
+                                    "revenue": details.get("item_total_price", 0.0)},
+                           "$setOnInsert": {"kind": "item", "item": item, "location_id": self.location_id}},
+                          upsert=True)
+            )
+        try:
+            self.rollups.bulk_write(updates, ordered=False)
+        except Exception as error:
+            print(f"Failed to update sales rollups: \n{error}")
+
+    def rebuild_rollups(self) -> None:
+        """
+        Recomputes this location's rollup documents from its full order history.
+        All of the work happens inside MongoDB, nothing but the pipelines leaves this process.
+        """
+        orders = self.db.get_collection("orders")
+        self.rollups.delete_many({"location_id": self.location_id})
+        # rollups from before there were locations carry no location_id and unprefixed ids
+        if self.location_id == tenants.default_location_id():
+            self.rollups.delete_many({"location_id": {"$exists": False}})
+        location = {"$literal": self.location_id}
+        orders.aggregate(self.__item_pipeline() + [
+            {"$project": {"_id": {"$concat": [self.__prefix, "item:", "$_id"]}, "kind": {"$literal": "item"},
+                          "item": "$_id", "qty": 1, "revenue": 1, "location_id": location}},
+            {"$merge": {"into": self.ROLLUP_COLLECTION, "whenMatched": "replace"}}
+        ])
+        orders.aggregate(self.__hour_pipeline() + [
+            {"$project": {"_id": {"$concat": [self.__prefix, "hour:",
+                                              {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$_id"}}]},
+                          "kind": {"$literal": "hour"}, "hour": "$_id", "order_count": 1, "revenue": 1,
+                          "location_id": location}},
+            {"$merge": {"into": self.ROLLUP_COLLECTION, "whenMatched": "replace"}}
+        ])
+        orders.aggregate([
+            {"$match": self.__order_filter},
+            {"$group": {"_id": f"{self.__prefix}totals", "order_count": {"$sum": 1},
+                        "revenue": {"$sum": {"$ifNull": ["$order_total", 0]}}}},
+            {"$addFields": {"kind": "totals", "location_id": location}},
+            {"$merge": {"into": self.ROLLUP_COLLECTION, "whenMatched": "replace"}}
+        ])
+
+    ##################################################
+    ################# DASHBOARD READS ################
+    ##################################################
+
+    def top_sellers(self, limit: int = 10) -> List[dict]:
+        """
+        Returns the best-selling items by quantity.
+        :param limit: number of items to return.
+        :return: list of {"item", "qty", "revenue"} dictionaries.
+        """
+        cursor = self.rollups.find({"location_id": self.location_id, "kind": "item"},
+                                   {"_id": 0, "item": 1, "qty": 1, "revenue": 1})
+        return [self.__round_revenue(doc) for doc in cursor.sort("qty", DESCENDING).limit(limit)]
+
+    def revenue_per_hour(self, start: datetime | None = None, end: datetime | None = None) -> List[dict]:
+        """
+        Returns order count and revenue for each hour that had sales.
+        :param start: optional inclusive lower bound on the hour.
+        :param end: optional exclusive upper bound on the hour.
+        :return: list of {"hour", "order_count", "revenue"} dictionaries, oldest first.
+        """
+        query = {"location_id": self.location_id, "kind": "hour"}
+        hour_range = {}
+        if start is not None:
+            hour_range["$gte"] = start
+        if end is not None:
+            hour_range["$lt"] = end
+        if hour_range:
+            query["hour"] = hour_range
+        cursor = self.rollups.find(query, {"_id": 0, "hour": 1, "order_count": 1, "revenue": 1})
+        return [self.__round_revenue(doc) for doc in cursor.sort("hour", ASCENDING)]
+
+    def average_ticket(self) -> dict:
+        """
+        Returns the number of orders, total revenue and average order total.
+        """
+        totals = self.rollups.find_one({"_id": f"{self.__prefix}totals"}) or {}
+        order_count = totals.get("order_count", 0)
+        revenue = totals.get("revenue", 0.0)
+        average = revenue / order_count if order_count else 0.0
+        return {"order_count": order_count, "revenue": round(revenue, 2), "average_ticket": round(average, 2)}
+
+    ##################################################
+    ############### AGGREGATION HELPERS ##############
+    ##################################################
+
+    # order_items is stored as {"ITEM NAME": {...}}, so it has to be turned into an array before unwinding
+    def __item_pipeline(self) -> List[dict]:
+        return [
+            {"$match": self.__order_filter},
+            {"$project": {"items": {"$objectToArray": "$order_items"}}},
+            {"$unwind": "$items"},
+            {"$match": {"items.v": {"$ne": None}}},
+            {"$group": {"_id": "$items.k",
+                        "qty": {"$sum": {"$ifNull": ["$items.v.item_qty", 0]}},
+                        "revenue": {"$sum": {"$ifNull": ["$items.v.item_total_price", 0]}}}}
+        ]
+
+    # orders don't carry a timestamp, the ObjectId creation time is when the order was placed
+    def __hour_pipeline(self) -> List[dict]:
+        return [
+            {"$match": self.__order_filter},
+            {"$group": {"_id": {"$dateTrunc": {"date": {"$toDate": "$_id"}, "unit": "hour"}},
+                        "order_count": {"$sum": 1},
+                        "revenue": {"$sum": {"$ifNull": ["$order_total", 0]}}}}
+        ]
+
+    @staticmethod
+    def __round_revenue(doc: dict) -> dict:
+        doc["revenue"] = round(doc.get("revenue", 0.0), 2)
+        return doc
@@ -0,0 +1,9 @@
+from functools import lru_cache
+
+from dotenv import load_dotenv, find_dotenv
+
+
+# the .env file only needs to be read once per process, no matter how many modules ask for it
+@lru_cache(maxsize=None)
+def load_environment() -> None:
+    load_dotenv(find_dotenv())
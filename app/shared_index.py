@@ -0,0 +1,242 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from app import few_shot
+from app import settings
+
+
+class StringTable:
+    """
+    Read-only strings stored back to back as UTF-8 in one memory-mapped file, with an offsets array.
+    """
+
+    def __init__(self, directory: str, name: str):
+        blob_path = os.path.join(directory, f"{name}.bin")
+        # np.memmap can't map an empty file
+        self.__blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else b""
+        self.__offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode="r")
+
+    @staticmethod
+    def write(directory: str, name: str, strings: List[str]) -> None:
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        with open(os.path.join(directory, f"{name}.bin"), "wb") as blob_file:
+            blob_file.write(b"".join(encoded))
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+
+    def __len__(self) -> int:
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, position: int) -> str:
+        return bytes(self.__blob[self.__offsets[position]:self.__offsets[position + 1]]).decode("utf-8")
+
+
+class StringPairs(Sequence):
+    """
+    Read-only [first, second] pairs stored next to each other in a StringTable, decoded one pair at a time
+    when they are read.
+    """
+
+    def __init__(self, strings: StringTable, start: int, rows: int):
+        self.__strings = strings
+        self.__start = start
+        self.__rows = rows
+
+    def __len__(self) -> int:
+        return self.__rows
+
+    def __getitem__(self, row: int) -> List[str]:
+        if not 0 <= row < self.__rows:
+            raise IndexError(row)
+        position = self.__start + 2 * row
+        return [self.__strings[position], self.__strings[position + 1]]
+
+
+class SharedIndex:
+    """
+    Menu, FAQ schema and few-shot similarity matrices, built once into a versioned directory that every
+    uvicorn worker on the machine maps read-only, instead of each worker loading and embedding its own copy.
+    The few-shot matrices are .npy files opened with mmap, so their pages are shared through the page cache.
+    The example texts live in a StringTable and are only decoded when an example is picked for a prompt.
+    The menu JSON and the FAQ field names are small, every worker reads its own copy of them: the menu snapshot
+    needs all of the menu anyway, and the field names are a handful of strings.
+
+    The directory holds one subdirectory per version and a CURRENT file naming the live one. A new version is
+    written next to the old one and CURRENT is swapped with os.replace, so readers see either version whole.
+    Builds happen under an exclusive flock on build.lock, and every live worker holds a shared flock on
+    workers.lock: the first worker to start finds no one else holding it and builds, the others map its build.
+    """
+    CHECK_INTERVAL = 5.0  # seconds between checks of CURRENT for a newer version
+    KEEP_VERSIONS = 2  # old versions stay around for workers that haven't switched yet
+
+    def __init__(self, directory: str):
+        """
+        :param directory: where the versions live, must be on a local file system for flock.
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.version: str | None = None
+        self.menu_json: str | None = None
+        self.faq_fields: List[str] = []
+        self.few_shot_tasks: Dict[str, dict] = {}
+        self.__checked_at = 0.0
+        self.__workers_lock = None
+
+    @classmethod
+    def from_environment(cls) -> "SharedIndex | None":
+        settings.load_environment()
+        directory = os.getenv("SHARED_INDEX_DIR")
+        return cls(directory) if directory else None
+
+    def join(self, db_helper) -> None:
+        """
+        Registers this process as a worker and maps the current version, building it first if this is the
+        first worker to start.
+        :param db_helper: DBHandler to read the menu and FAQ from when building.
+        """
+        with self.__build_lock():
+            self.__workers_lock = open(os.path.join(self.directory, "workers.lock"), "a")
+            try:
+                fcntl.flock(self.__workers_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                first_worker = True
+            except BlockingIOError:
+                first_worker = False
+            if first_worker or self.__current() is None:
+                self.__build(db_helper)
+            # from here on this worker counts as live until it exits
+            fcntl.flock(self.__workers_lock, fcntl.LOCK_SH)
+        self.load()
+
+    def rebuild(self, db_helper) -> str:
+        """
+        Rereads the menu and FAQ from the database and publishes them as a new version.
+        The other workers pick it up on their next reload_if_changed.
+        :param db_helper: DBHandler to read from.
+        :return: the new version.
+        """
+        db_helper.refresh_caches()
+        with self.__build_lock():
+            version = self.__build(db_helper)
+        self.load()
+        return version
+
+    def reload_if_changed(self) -> bool:
+        """
+        Maps the current version if it changed since the last load. Only looks at CURRENT every CHECK_INTERVAL.
+        :return: True if a new version was loaded.
+        """
+        now = time.monotonic()
+        if now - self.__checked_at < self.CHECK_INTERVAL:
+            return False
+        self.__checked_at = now
+        if self.__current() == self.version:
+            return False
+        return self.load()
+
+    def load(self) -> bool:
+        """
+        Maps the version named in CURRENT.
+        :return: False if there is no version yet.
+        """
+        version = self.__current()
+        if version is None:
+            return False
+        version_directory = os.path.join(self.directory, version)
+        with open(os.path.join(version_directory, "manifest.json"), encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        with open(os.path.join(version_directory, "menu.json"), encoding="utf-8") as menu_file:
+            menu_json = menu_file.read()
+        strings = StringTable(version_directory, "strings")
+        start, end = manifest["faq_fields"]
+        faq_fields = [strings[position] for position in range(start, end)]
+        few_shot_tasks = {}
+        for task, config in manifest["few_shot"].items():
+            few_shot_tasks[task] = {
+                "k": config["k"],
+                "examples": StringPairs(strings, config["strings"], config["rows"]),
+                "matrix": np.load(os.path.join(version_directory, f"few_shot_{task}.npy"), mmap_mode="r"),
+            }
+        self.menu_json, self.faq_fields, self.few_shot_tasks = menu_json, faq_fields, few_shot_tasks
+        self.version = version
+        return True
+
+    def close(self) -> None:
+        if self.__workers_lock is not None:
+            self.__workers_lock.close()
+            self.__workers_lock = None
+
+    ##################################################
+    #################### HELPERS #####################
+    ##################################################
+
+    @contextmanager
+    def __build_lock(self):
+        with open(os.path.join(self.directory, "build.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __current(self) -> str | None:
+        try:
+            with open(os.path.join(self.directory, "CURRENT"), encoding="utf-8") as current_file:
+                return current_file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    # only called while holding the build lock
+    def __build(self, db_helper) -> str:
+        menu_json = db_helper.get_menu()
+        faq_fields = db_helper.get_all_field_names("FAQ")
+        few_shot_tasks = few_shot.FewShotStore.from_environment().export_tasks()
+
+        # sortable by build time, the suffix keeps builds from two machines sharing a directory apart
+        version = f"{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+        staging = os.path.join(self.directory, f"{version}.tmp")
+        os.makedirs(staging)
+        strings = list(faq_fields)
+        manifest = {"version": version, "built_at": time.time(), "faq_fields": [0, len(faq_fields)],
+                    "few_shot": {}}
+        for task, config in few_shot_tasks.items():
+            manifest["few_shot"][task] = {"k": config["k"], "rows": len(config["examples"]),
+                                          "strings": len(strings)}
+            for user_input, output in config["examples"]:
+                strings.extend([user_input, output])
+            np.save(os.path.join(staging, f"few_shot_{task}.npy"), np.ascontiguousarray(config["matrix"]))
+        StringTable.write(staging, "strings", strings)
+        with open(os.path.join(staging, "menu.json"), "w", encoding="utf-8") as menu_file:
+            menu_file.write(menu_json)
+        with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.rename(staging, os.path.join(self.directory, version))
+
+        pointer = os.path.join(self.directory, "CURRENT.tmp")
+        with open(pointer, "w", encoding="utf-8") as pointer_file:
+            pointer_file.write(version)
+            pointer_file.flush()
+            os.fsync(pointer_file.fileno())
+        os.replace(pointer, os.path.join(self.directory, "CURRENT"))
+        self.__remove_old_versions(version)
+        return version
+
+    def __remove_old_versions(self, current: str) -> None:
+        names = [name for name in os.listdir(self.directory)
+                 if os.path.isdir(os.path.join(self.directory, name)) and name != current]
+        # staging directories left by a crashed build can go too, the build lock is held
+        stale = [name for name in names if name.endswith(".tmp")]
+        finished = sorted(name for name in names if not name.endswith(".tmp"))
+        stale.extend(finished[:max(0, len(finished) - (self.KEEP_VERSIONS - 1))])
+        # workers still on a removed version keep their mappings, unlinked files stay readable
+        for name in stale:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
@@ -0,0 +1,193 @@
+import os
+import time
+from contextlib import contextmanager
+
+from app import ai_assistant as assist
+from app import DBHelper
+from app import event_log
+from app import few_shot
+from app import kitchen_feed
+from app import shared_index
+from app import tenants
+from app import settings
+
+# taken when the module is first imported, which is as close to process start as the app gets
+_IMPORTED_AT = time.perf_counter()
+
+
+class Services:
+    """
+    Everything the API needs that does I/O to build.
+    Nothing is created at import time, warm_up does the work and records how long each stage took.
+    A failed warm_up can be retried, after MAX_WARM_UP_ATTEMPTS failures the services count as unhealthy
+    so the orchestrator restarts the process instead of leaving it unready forever.
+    """
+    MAX_WARM_UP_ATTEMPTS = 8  # WARM_UP_MAX_ATTEMPTS overrides it
+    RETRY_BASE_SECONDS = 1.0
+    RETRY_MAX_SECONDS = 30.0
+
+    def __init__(self):
+        self.db_helper: DBHelper.DBHandler | None = None
+        self.chatbot: assist.AIAssistant | None = None
+        self.turn_log: event_log.TurnEventLog | None = None
+        self.kitchen_feed: kitchen_feed.KitchenFeed | None = None
+        self.change_stream_tailer: kitchen_feed.ChangeStreamTailer | None = None
+        self.shared_index: shared_index.SharedIndex | None = None
+        self.few_shot_store: few_shot.FewShotStore | None = None
+        self.tenants: tenants.TenantRegistry | None = None
+        self.ready = False
+        self.error: str | None = None
+        self.timings = {}
+        self.attempts = 0
+
+    @contextmanager
+    def __timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+    def warm_up(self) -> None:
+        """
+        Connects to the database, fills the menu and FAQ caches and builds the assistant.
+        Marks the services ready only if every stage succeeded.
+        """
+        start = time.perf_counter()
+        # whatever a failed attempt left behind is closed before starting over
+        self.__release()
+        self.attempts += 1
+        try:
+            with self.__timed("environment"):
+                settings.load_environment()
+            with self.__timed("connect"):
+                self.db_helper = DBHelper.DBHandler()
+                if not self.db_helper.ping():
+                    raise ConnectionError("MongoDB did not answer the ping.")
+            with self.__timed("indexes"):
+                self.db_helper.ensure_indexes()
+            self.shared_index = shared_index.SharedIndex.from_environment()
+            if self.shared_index is not None:
+                # with several workers only the first one reads and indexes, the rest map its build
+                with self.__timed("shared_index"):
+                    self.shared_index.join(self.db_helper)
+                    self.few_shot_store = few_shot.FewShotStore({})
+                    self.__apply_shared_index()
+            else:
+                with self.__timed("faq_schema"):
+                    self.db_helper.get_all_field_names("FAQ")
+                with self.__timed("few_shot_index"):
+                    self.few_shot_store = few_shot.default_store()
+            with self.__timed("menu"):
+                # builds the parsed menu and the rendered welcome menu in one go
+                self.db_helper.get_menu_snapshot()
+            with self.__timed("kitchen_feed"):
+                self.__open_kitchen_feed()
+            with self.__timed("turn_log"):
+                self.turn_log = self.__open_turn_log()
+            with self.__timed("assistant"):
+                self.chatbot = self.__restored_assistant(self.db_helper)
+            with self.__timed("tenants"):
+                default_tenant = tenants.Tenant(self.db_helper.location_id, self.db_helper, self.chatbot)
+                self.tenants = tenants.TenantRegistry(default_tenant, self.__build_tenant)
+            self.ready = True
+            self.error = None
+        except Exception as error:
+            self.error = str(error)
+            print(f"Startup failed: \n{error}")
+        finally:
+            self.timings["warm_up_total"] = round((time.perf_counter() - start) * 1000, 2)
+            self.timings["since_import"] = round((time.perf_counter() - _IMPORTED_AT) * 1000, 2)
+
+    # TURN_EVENT_LOG is "file", "mongo" or unset to turn the log off, the worker slot locks live in the directory
+    def __open_turn_log(self) -> event_log.TurnEventLog | None:
+        directory = os.getenv("TURN_EVENT_LOG_DIR", "turn_logs")
+        match os.getenv("TURN_EVENT_LOG", "").lower():
+            case "file":
+                return event_log.TurnEventLog(directory)
+            case "mongo":
+                return event_log.TurnEventLog(directory, mongo_db=self.db_helper.db)
+            case _:
+                return None
+
+    # other locations are loaded on their first request and share the default location's connection
+    def __build_tenant(self, location_id: str) -> tenants.Tenant:
+        db_helper = self.db_helper.for_location(location_id)
+        if not db_helper.get_menu_snapshot().items():
+            raise tenants.UnknownLocation(location_id)
+        return tenants.Tenant(location_id, db_helper, self.__restored_assistant(db_helper))
+
+    # picks the location's last logged conversation back up so a restart doesn't lose the order in progress
+    def __restored_assistant(self, db_helper: DBHelper.DBHandler) -> assist.AIAssistant:
+        session_id = self.turn_log.last_session_id(db_helper.location_id) if self.turn_log is not None else None
+        chatbot = assist.AIAssistant(db_helper, self.turn_log, session_id, few_shot_store=self.few_shot_store)
+        chatbot.restore_from_log()
+        return chatbot
+
+    # the shared index holds the default location, other locations are read by each worker on first use
+    def __apply_shared_index(self) -> None:
+        self.db_helper.seed_caches(self.shared_index.menu_json, {"FAQ": self.shared_index.faq_fields})
+        self.few_shot_store.replace_tasks(self.shared_index.few_shot_tasks)
+
+    def sync_shared_index(self) -> None:
+        """
+        Switches to a newer shared index version if another worker published one. Cheap enough to call per request.
+        """
+        if self.shared_index is not None and self.shared_index.reload_if_changed():
+            self.__apply_shared_index()
+
+    def rebuild_shared_index(self) -> str | None:
+        """
+        Rereads the menu and FAQ and publishes them to every worker.
+        :return: the new shared index version, or None when the shared index is off and only this process refreshed.
+        """
+        if self.shared_index is None:
+            self.db_helper.refresh_caches()
+            self.db_helper.get_menu_snapshot()
+            return None
+        version = self.shared_index.rebuild(self.db_helper)
+        self.__apply_shared_index()
+        return version
+
+    # KITCHEN_FEED_SOURCE is "writes" (orders written by this process) or "change_stream" (every writer)
+    def __open_kitchen_feed(self) -> None:
+        self.kitchen_feed = kitchen_feed.KitchenFeed(
+            snapshot_source=lambda location_id: self.db_helper.read_recent_orders(location_id=location_id))
+        if os.getenv("KITCHEN_FEED_SOURCE", "writes").lower() == "change_stream":
+            self.change_stream_tailer = kitchen_feed.ChangeStreamTailer(self.db_helper.db.orders,
+                                                                        self.kitchen_feed).start()
+        else:
+            self.db_helper.order_listeners.append(self.kitchen_feed.publish)
+
+    def shutdown(self) -> None:
+        self.ready = False
+        self.__release()
+
+    def __release(self) -> None:
+        if self.change_stream_tailer is not None:
+            self.change_stream_tailer.stop()
+        if self.turn_log is not None:
+            self.turn_log.close()
+        if self.shared_index is not None:
+            self.shared_index.close()
+        if self.db_helper is not None:
+            self.db_helper.client.close()
+        self.db_helper = self.chatbot = self.turn_log = self.kitchen_feed = None
+        self.change_stream_tailer = self.shared_index = self.few_shot_store = self.tenants = None
+
+    def retry_delay(self) -> float:
+        """
+        Seconds to wait before the next warm_up attempt, doubling after every failure.
+        """
+        return min(self.RETRY_MAX_SECONDS, self.RETRY_BASE_SECONDS * 2 ** max(0, self.attempts - 1))
+
+    def gave_up(self) -> bool:
+        """
+        True once warm_up failed MAX_WARM_UP_ATTEMPTS times in a row.
+        """
+        settings.load_environment()
+        max_attempts = int(os.getenv("WARM_UP_MAX_ATTEMPTS", self.MAX_WARM_UP_ATTEMPTS))
+        return not self.ready and self.attempts >= max_attempts
+
+    def readiness(self) -> dict:
+        return {"ready": self.ready, "error": self.error, "attempts": self.attempts, "timings_ms": self.timings}
@@ -0,0 +1,102 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+
+from app import settings
+
+_LOCATION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class UnknownLocation(KeyError):
+    """
+    Raised for a location id that is malformed or has no menu.
+    """
+
+
+def default_location_id() -> str:
+    settings.load_environment()
+    return os.getenv("DEFAULT_LOCATION_ID", "main")
+
+
+def location_filter(location_id: str) -> dict:
+    """
+    Returns the query that selects one location's documents in a shared collection.
+    Documents from before there were locations have no location_id and belong to the default location.
+    """
+    if location_id == default_location_id():
+        return {"location_id": {"$in": [location_id, None]}}
+    return {"location_id": location_id}
+
+
+class Tenant:
+    """
+    Everything scoped to one location: its DBHandler, with that location's menu and FAQ caches,
+    and its assistant.
+    """
+
+    def __init__(self, location_id: str, db_helper, chatbot):
+        self.location_id = location_id
+        self.db_helper = db_helper
+        self.chatbot = chatbot
+
+
+class TenantRegistry:
+    """
+    Hands out the Tenant for a location id, building it on first use.
+    The menu and FAQ caches of the locations are kept warm in an LRU so one set of workers can serve every location
+    while memory stays bounded. A cold location's caches are dropped and read from the database again when it gets
+    traffic, but the tenant itself is kept, so its assistant doesn't lose the order in progress. The default
+    location is built at startup and its caches are never dropped.
+    """
+    DEFAULT_MAX_TENANTS = 32
+
+    def __init__(self, default_tenant: Tenant, build_tenant: Callable[[str], Tenant],
+                 max_tenants: int | None = None):
+        """
+        :param default_tenant: served when a request doesn't name a location.
+        :param build_tenant: builds the tenant of a location, raises UnknownLocation if there is no such location.
+        :param max_tenants: most non-default locations with warm caches, TENANT_CACHE_SIZE by default.
+        """
+        self.default_tenant = default_tenant
+        self.__build_tenant = build_tenant
+        self.max_tenants = max_tenants or int(os.getenv("TENANT_CACHE_SIZE", self.DEFAULT_MAX_TENANTS))
+        self.__tenants = {}
+        self.__warm = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, location_id: str | None) -> Tenant:
+        """
+        :param location_id: location named by the request, None for the default location.
+        :raises UnknownLocation: if the location id is malformed or the location has no menu.
+        """
+        if location_id is None or location_id == self.default_tenant.location_id:
+            return self.default_tenant
+        if not _LOCATION_ID_PATTERN.fullmatch(location_id):
+            raise UnknownLocation(location_id)
+        with self.__lock:
+            if location_id in self.__tenants:
+                self.__mark_warm(location_id)
+                return self.__tenants[location_id]
+        # built outside the lock so a new location doesn't hold up requests for the others
+        tenant = self.__build_tenant(location_id)
+        with self.__lock:
+            tenant = self.__tenants.setdefault(location_id, tenant)
+            self.__mark_warm(location_id)
+        return tenant
+
+    def loaded_locations(self) -> List[str]:
+        """
+        Returns the locations whose menu and FAQ caches are warm.
+        """
+        with self.__lock:
+            return [self.default_tenant.location_id, *self.__warm]
+
+    # only called while holding the lock
+    def __mark_warm(self, location_id: str) -> None:
+        self.__warm[location_id] = True
+        self.__warm.move_to_end(location_id)
+        while len(self.__warm) > self.max_tenants:
+            cold_location, _ = self.__warm.popitem(last=False)
+            self.__tenants[cold_location].db_helper.refresh_caches()
@@ -0,0 +1,84 @@
+import pytest
+
+from app import local_rules
+
+
+@pytest.mark.parametrize("reply", [
+    "yes",
+    "Yes please submit it, nothing else",
+    "Looks good, thanks!",
+    "Yep that's correct",
+    "ok",
+])
+def test_plain_confirmation_is_yes(reply):
+    assert local_rules.order_verification(reply) == "yes"
+
+
+@pytest.mark.parametrize("reply", [
+    "Sure, but swap the nachos for fries",
+    "no",
+    "That's not right",
+    "yes, add a Hopzilla",
+    "yes...",
+    "Can I pay by card instead?",
+])
+def test_anything_but_a_plain_confirmation_is_no(reply):
+    assert local_rules.order_verification(reply) == "no"
+
+
+@pytest.mark.parametrize("user_prompt, name", [
+    ("My name is Jane Doe", "Jane Doe"),
+    ("put it under the name bob", "Bob"),
+    ("I'm Sam", "Sam"),
+    ("Hi, I am Alex Smith and I'd like nachos", "Alex Smith"),
+])
+def test_name_is_extracted(user_prompt, name):
+    assert local_rules.user_name_extractor(user_prompt) == name
+
+
+@pytest.mark.parametrize("user_prompt", [
+    "this is great",
+    "I'm ordering for pickup",
+    "i am hungry",
+    "I'm Ready to order",
+    "two loaded nachos please",
+])
+def test_no_name_is_made_up(user_prompt):
+    assert local_rules.user_name_extractor(user_prompt) == "None"
+
+
+def test_phone_is_normalized():
+    assert local_rules.user_phone_extractor("call me at (555) 123-4567") == "555-123-4567"
+    assert local_rules.user_phone_extractor("no phone here") == "000-000-0000"
+
+
+def test_email():
+    assert local_rules.user_email_extractor("it's jane.doe+beer@example.com") == "jane.doe+beer@example.com"
+    assert local_rules.user_email_extractor("no email") == "None"
+
+
+@pytest.mark.parametrize("user_prompt, method", [
+    ("I'll pay cash", "Cash"),
+    ("visa please", "Card"),
+    ("half cash half card", "Both"),
+    ("not sure yet", "None"),
+])
+def test_payment_method(user_prompt, method):
+    assert local_rules.payment_method_extractor(user_prompt) == method
+
+
+@pytest.mark.parametrize("user_prompt, expected", [
+    ("my number is 555-123-4567", "order food"),
+    ("What are your hours?", "question answer"),
+    ("What beers do you have?", "get menu"),
+    ("two loaded nachos", "order food"),
+])
+def test_intent(user_prompt, expected):
+    assert local_rules.intent(user_prompt) == expected
+
+
+def test_order_items_with_quantities():
+    names = ["Loaded Nachos", "Hopzilla", "Velvet Lager"]
+    assert local_rules.order_items("two loaded nachos and 3 pints of hopzilla", names) == {
+        "Loaded Nachos": {"item_qty": 2}, "Hopzilla": {"item_qty": 3}}
+    assert local_rules.order_items("what's good here?", names) is None
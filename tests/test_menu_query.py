@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from app.menu_snapshot import MenuSnapshot
+
+MENU_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "app", "menu.json")
+
+
+@pytest.fixture(scope="module")
+def engine():
+    with open(MENU_PATH, encoding="utf-8") as menu_file:
+        return MenuSnapshot([json.load(menu_file)]).query_engine
+
+
+def test_under_leaves_out_the_limit_itself(engine):
+    answer = engine.answer("What beers under $7 do you have?")
+    assert "Velvet Lager" in answer
+    assert "Enchanted Abbey" not in answer
+
+
+def test_at_most_keeps_the_limit_itself(engine):
+    answer = engine.answer("What beers at most $7 do you have?")
+    assert "Velvet Lager" in answer
+    assert "Enchanted Abbey" in answer
+
+
+def test_over_leaves_out_the_limit_itself(engine):
+    assert engine.answer("What beers over $7.50?") == "Sorry, nothing on the menu matches that."
+
+
+def test_abv_comparison(engine):
+    answer = engine.answer("Any beers stronger than 9%?")
+    assert "Enchanted Abbey" in answer
+    assert "Hopzilla" not in answer
+
+
+def test_missing_item_is_named_the_way_the_user_said_it(engine):
+    assert engine.answer("Do you have fries?") == "Sorry, we don't have fries on the menu."
+
+
+def test_multi_word_term_is_not_matched_across_a_description(engine):
+    assert engine.answer("Do you guys have grilled cheese?") == "Sorry, we don't have grilled cheese on the menu."
+
+
+def test_multi_word_term_found_in_a_description(engine):
+    answer = engine.answer("Do you have sour cream?")
+    assert answer.startswith("We don't have sour cream on the menu, but these items come with it:")
+    assert "Loaded Nachos" in answer
+
+
+def test_existence_by_name(engine):
+    assert engine.answer("Do you have mozzarella?") == "Yes! We have:\n- Mozzarella Sticks - $7.00"
+
+
+def test_category_word_finds_the_category(engine):
+    answer = engine.answer("what burgers do you have")
+    assert "Classic Cheeseburger" in answer
+    assert "Mushroom Swiss Burger" in answer
+
+
+def test_price(engine):
+    assert engine.answer("How much are the loaded nachos?") == "The Loaded Nachos is $8.50."
+
+
+def test_cheapest(engine):
+    answer = engine.answer("What's the cheapest beer?")
+    assert answer == "Here's what we have:\n- Velvet Lager (Lager, 4.8% ABV) - $5.50"
+
+
+def test_open_ended_question_is_left_to_the_model(engine):
+    assert engine.answer("What beer would you recommend with the nachos?") is None
+
+
+def test_search_matches_descriptions(engine):
+    assert [item["name"] for item in engine.search("marinara")] == ["Mozzarella Sticks"]